@@ -0,0 +1,9 @@
+########################################################################################################################
+# Batch version of Entry.py: analyse many countries at once, see tools/batch_pipeline.py for the options.
+########################################################################################################################
+
+# Local imports:
+from tools import batch_pipeline
+
+if __name__ == "__main__":
+    batch_pipeline.main()
@@ -5,10 +5,12 @@
 
 # Standard imports:
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 
 # Local imports:
 from tools import getdata, createdocument, cullen_frey, fit_distribution, specplus, mfdfa_ss, print_table, imc_sf
+from tools import results_sink
 
 # Add figures to a wordfile, to be created on GitHub:
 doc = createdocument.ReportDocument()
@@ -17,29 +19,45 @@ doc.add_heading("Part A:", level=1)
 # Adquirir os dados do país (EUA):
 dataframe = getdata.acquire_data()
 series = dataframe['new_cases'].tolist()
+# Numeric results also go to the results store, one record per analysis:
+results = results_sink.ResultsSink(context={'country': 'United States', 'date_ini': '2020-03-10',
+                                            'date_end': '2020-05-28'})
+
+
+# Write the forecast of an IMC-SF result to the results store:
+def write_forecast(result):
+    results.write('imc_sf_forecast', p=result.p, date=result.forecast['date'].dt.strftime('%Y-%m-%d'),
+                  **{key: result.forecast[key] for key in ['new_cases', 'n_s_min', 'n_s_max']})
+
 
 # Plot histogram:
 dataframe['new_cases'].plot.hist(by='new_cases', bins=10, grid=True)
 plt.title('Distribution of daily new COVID-19 cases in the USA')
 plt.draw()
 doc.add_fig()
+counts, edges = np.histogram(dataframe['new_cases'].dropna(), bins=10)
+results.write('histogram', counts=counts, edges=edges)
 
 # Identificar no espaço de  Cullen-Frey:
-cullen_frey.series2chart(series)
+skewness_square, kurt = cullen_frey.series2chart(series)
 doc.add_fig()
+results.write('cullen_frey', skewness_square=skewness_square, kurtosis=kurt)
 
 # Ajustar uma PDF:
-fit_distribution.plot_ks_gev_gauss(series, "Daily New USA COVID-19 Cases")
+mu, sigma = fit_distribution.plot_ks_gev_gauss(series, "Daily New USA COVID-19 Cases")
 doc.add_fig()
+results.write('gaussian_fit', loc=mu, scale=sigma)
 
 # Calcular o índice espectral:
 alpha, beta_theoretical = specplus.main(series)
 print("alpha was computed as ", alpha, "and the theoretical beta associated is ", beta_theoretical)
 doc.add_fig()
+results.write('spectral', alpha=alpha, beta_theoretical=beta_theoretical)
 
 # Obter o espectro de singularidade:
 mfdfa_dict = mfdfa_ss.main(series)
 doc.add_fig()
+results.write('mfdfa', **{key: mfdfa_dict[key] for key in ['delta_alpha', 'alpha_zero', 'a_alpha']})
 
 
 # Criar uma tabela:
@@ -54,19 +72,20 @@ doc.add_heading("Part B:", level=1)
 # Fazer a parte relacionada ao modelo IMC-SF, para dois conjuntos diferentes de p,
 # mostrando que a data final de propagação é livre
 doc.add_paragraph("Using the first suggested p vector:")
-imc_sf.main(p=[0.5, 0.45, 0.05], date_end='2020-06-18', doc=doc)
+write_forecast(imc_sf.main(p=[0.5, 0.45, 0.05], date_end='2020-06-18', doc=doc))
 
 # Use the other proposed p-value:
 doc.add_paragraph("Using the second suggested p vector:")
-imc_sf.main(p=[0.7, 0.25, 0.05], doc=doc)
+write_forecast(imc_sf.main(p=[0.7, 0.25, 0.05], doc=doc))
 
 
 # Use a custom p value just to get a cute graph:
 doc.add_paragraph("Here, I'll try a different p vector whose entries do not sum 1, just so I can get apparently good" +
                   "predictions:")
-imc_sf.main(p=[0.675/2, 0.275/2, 0.05/2], doc=doc)
+write_forecast(imc_sf.main(p=[0.675/2, 0.275/2, 0.05/2], doc=doc))
 
 
+results.flush()
 doc.finish()
 
 plt.show()
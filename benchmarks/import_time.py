@@ -0,0 +1,91 @@
+########################################################################################################################
+# Import time of the tools modules, each measured in a fresh interpreter with python -X importtime, along with the heavy
+# dependencies each import actually executes. Results are printed as a table and optionally appended to a JSON lines
+# file, so the startup cost of worker processes and command line invocations can be tracked over time.
+#
+# Usage: python benchmarks/import_time.py [--modules getdata specplus ...] [--repeat 5] [--output import_time.jsonl]
+#
+# Written by Rian Koja to publish in a GitHub repository with specified license.
+########################################################################################################################
+
+# Standard imports:
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+repository_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+
+# Dependencies whose import is worth avoiding when they are not needed:
+heavy_modules = ['matplotlib', 'matplotlib.pyplot', 'seaborn', 'scipy', 'scipy.stats', 'scipy.signal', 'scipy.optimize',
+                 'docx', 'pandas']
+
+default_modules = ['mfdfa_ss_m3', 'mfdfa_ss_core', 'mfdfa_ss', 'specplus', 'rolling_spectra', 'surrogates', 'getdata',
+                   'imc_sf', 'imc_sf_calibration', 'cullen_frey', 'kde', 'fit_distribution', 'print_table',
+                   'createdocument', 'batch_pipeline']
+
+# Run in the child interpreter: lazily imported modules only enter sys.modules once they are executed:
+probe = """
+import sys, json
+import tools.{module}
+print(json.dumps([name for name in {heavy!r} if name in sys.modules]))
+"""
+
+
+# Import tools.<module> in a fresh interpreter. Returns the cumulative import time reported by -X importtime, the wall
+# time of the whole process and the heavy modules executed:
+def measure(module):
+    time_ini = time.perf_counter()
+    command = [sys.executable, '-X', 'importtime', '-c', probe.format(module=module, heavy=heavy_modules)]
+    process = subprocess.run(command, cwd=repository_dir, capture_output=True, text=True)
+    wall_time = time.perf_counter() - time_ini
+    if process.returncode != 0:
+        return {'module': module, 'error': process.stderr.strip().splitlines()[-1]}
+
+    cumulative_us = None
+    for line in process.stderr.splitlines():
+        # Lines read "import time: self [us] | cumulative | imported package":
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == 'tools.' + module:
+            cumulative_us = int(fields[1])
+    return {'module': module, 'import_s': cumulative_us / 1e6, 'process_s': wall_time,
+            'heavy_loaded': json.loads(process.stdout.strip().splitlines()[-1])}
+
+
+# Measure every module 'repeat' times, keeping the fastest run of each:
+def run(modules=None, repeat=5):
+    results = []
+    for module in modules or default_modules:
+        runs = [measure(module) for _ in range(repeat)]
+        valid = [result for result in runs if 'error' not in result]
+        results.append(min(valid, key=lambda result: result['import_s']) if valid else runs[0])
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the import time of the tools modules.")
+    parser.add_argument('--modules', nargs='+', default=None)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None, help="JSON lines file to append the results to")
+    args = parser.parse_args(argv)
+
+    results = run(args.modules, args.repeat)
+    print("{:<20} {:>10} {:>11}  {}".format('module', 'import [s]', 'process [s]', 'heavy modules executed'))
+    for result in results:
+        if 'error' in result:
+            print("{:<20} {}".format(result['module'], result['error']))
+        else:
+            print("{:<20} {:>10.3f} {:>11.3f}  {}".format(result['module'], result['import_s'], result['process_s'],
+                                                          ', '.join(result['heavy_loaded']) or '-'))
+    if args.output is not None:
+        with open(args.output, 'a') as output_file:
+            output_file.write(json.dumps({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                                          'python': sys.version.split()[0], 'results': results}) + '\n')
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+########################################################################################################################
+# Run time and peak memory of the numerical kernels (spectral density, DFA, MF-DFA and the IMC-SF model) on synthetic
+# series of 2^8 to 2^22 samples and on the OWID slice used by Entry.py. Results are printed as a table, appended to a
+# JSON lines history and optionally compared with a stored baseline, flagging every kernel that got slower or uses more
+# memory than the baseline allows.
+#
+# Usage: python benchmarks/kernels.py [--kernels psd dfa1d ...] [--min-log2 8] [--max-log2 22] [--step 2] [--repeat 3]
+#                                     [--no-owid] [--history history.jsonl] [--save-baseline] [--check]
+#                                     [--tolerance 0.25]
+#
+# Written by Rian Koja to publish in a GitHub repository with specified license.
+########################################################################################################################
+
+# Standard imports:
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+benchmarks_dir = os.path.dirname(os.path.realpath(__file__))
+repository_dir = os.path.join(benchmarks_dir, '..')
+sys.path.insert(0, repository_dir)
+
+# Local imports:
+from tools import getdata, imc_sf, specplus  # noqa: E402
+import tools.mfdfa_ss_core as mfdfa_core  # noqa: E402
+import tools.mfdfa_ss_m1 as mfdfa1  # noqa: E402
+import tools.mfdfa_ss_m2 as mfdfa2  # noqa: E402
+import tools.mfdfa_ss_m3 as mfdfa3  # noqa: E402
+
+
+history_filename = os.path.join(benchmarks_dir, 'history.jsonl')
+baseline_filename = os.path.join(benchmarks_dir, 'baseline.json')
+
+# Days forecast by the IMC-SF benchmarks, and the longest synthetic history they run on, since pandas dates only span
+# about 2^17 days from their earliest one:
+forecast_days = 30
+max_log2_imc_sf = 17
+
+
+# Positive series with a random walk trend, like the daily new cases:
+def synthetic_series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return 1000.0 + np.abs(np.cumsum(rng.normal(0.0, 10.0, n)))
+
+
+# Frame with the columns given by getdata, with one day per value:
+def series_frame(series):
+    return pd.DataFrame({'date': pd.date_range('1678-01-01', periods=len(series), freq='D'), 'new_cases': series})
+
+
+# Fitted model built from a frame (instead of reading its data through getdata), as RefData does on construction:
+def build_refdata(frame):
+    model = imc_sf.RefData.from_state({'p': [0.5, 0.45, 0.05], 'country': 'benchmark', 'forecast_end': None,
+                                       'history': {'date': [], 'new_cases': []}})
+    model.append(frame)
+    return model
+
+
+def prepare_forecast(frame):
+    model = build_refdata(frame)
+    date_end = model.df.iloc[-1]['date'] + pd.Timedelta(days=forecast_days)
+    return lambda: model.forecast(date_end=date_end)
+
+
+# The MF-DFA functions keep the windows of recent series in the mfdfa_ss_core cache, so the cache is emptied before
+# every call to time the kernel rather than a cache hit:
+def uncached(function, *args):
+    def call():
+        mfdfa_core.clear_cache()
+        return function(*args)
+    return call
+
+
+def prepare_scaling_exponents(series):
+    time_measure, mean_data_measure, _ = mfdfa1.get_hurst_by_upscaling(series)
+    return lambda: mfdfa3.get_scaling_exponents(time_measure, mean_data_measure)
+
+
+# Each kernel: the function that prepares (untimed) the call to measure from a series, and the largest series size it
+# runs on:
+kernels = {
+    'psd': (lambda series: lambda: specplus.psd(series), None),
+    'dfa1d': (lambda series: lambda: specplus.dfa1d(series, 1), None),
+    'hurst_by_upscaling': (lambda series: uncached(mfdfa1.get_hurst_by_upscaling, series), None),
+    'mss_by_upscaling': (lambda series: uncached(mfdfa2.get_mss_by_upscaling, series), None),
+    'scaling_exponents': (prepare_scaling_exponents, None),
+    'refdata': (lambda series: (lambda frame: lambda: build_refdata(frame))(series_frame(series)), max_log2_imc_sf),
+    'forecast': (lambda series: prepare_forecast(series_frame(series)), max_log2_imc_sf),
+}
+
+
+# Best time of a call over 'repeat' runs, each of as many calls as take at least 0.2 s, and its peak memory allocation
+# (numpy arrays included) in a separate run, since tracing slows the call down:
+def measure(function, repeat=3):
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    time_s = min(timer.repeat(repeat=repeat, number=number)) / number
+    tracemalloc.start()
+    function()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'time_s': time_s, 'peak_bytes': peak_bytes, 'number': number}
+
+
+# The inputs to run on, as (name, series) pairs: synthetic series of every size and, if available, the OWID slice:
+def inputs(min_log2=8, max_log2=22, step=2, owid=True):
+    cases = [('synthetic', synthetic_series(2 ** log2)) for log2 in range(min_log2, max_log2 + 1, step)]
+    if owid:
+        try:
+            cases.append(('owid', getdata.acquire_data()['new_cases'].values.astype(np.float64)))
+        except Exception as error:
+            print("OWID slice not available:", repr(error))
+    return cases
+
+
+def run(kernel_names=None, min_log2=8, max_log2=22, step=2, repeat=3, owid=True):
+    results = []
+    for input_name, series in inputs(min_log2, max_log2, step, owid):
+        for name in kernel_names or kernels:
+            prepare, max_size_log2 = kernels[name]
+            if max_size_log2 is not None and len(series) > 2 ** max_size_log2:
+                continue
+            result = {'kernel': name, 'input': input_name, 'n': len(series)}
+            try:
+                result.update(measure(prepare(series), repeat))
+            except Exception as error:
+                result['error'] = repr(error)
+            print_result(result)
+            results.append(result)
+    return results
+
+
+def print_result(result):
+    if 'error' in result:
+        print("{:<20} {:<10} {:>9}  {}".format(result['kernel'], result['input'], result['n'], result['error']))
+    else:
+        print("{:<20} {:<10} {:>9} {:>12.6f} {:>12.1f}".format(result['kernel'], result['input'], result['n'],
+                                                               result['time_s'], result['peak_bytes'] / 2 ** 20))
+
+
+def result_key(result):
+    return '{}/{}/{}'.format(result['kernel'], result['input'], result['n'])
+
+
+# Results slower or using more memory than the baseline by more than 'tolerance' (a fraction of the baseline):
+def regressions(results, baseline, tolerance=0.25):
+    flagged = []
+    for result in results:
+        reference = baseline.get(result_key(result))
+        if reference is None or 'error' in result or 'error' in reference:
+            continue
+        for metric in ['time_s', 'peak_bytes']:
+            ratio = result[metric] / reference[metric] if reference[metric] > 0 else 1.0
+            if ratio > 1.0 + tolerance:
+                flagged.append({'key': result_key(result), 'metric': metric, 'baseline': reference[metric],
+                                'value': result[metric], 'ratio': ratio})
+    return flagged
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repository_dir, capture_output=True,
+                              text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the numerical kernels.")
+    parser.add_argument('--kernels', nargs='+', default=None, choices=list(kernels))
+    parser.add_argument('--min-log2', type=int, default=8)
+    parser.add_argument('--max-log2', type=int, default=22)
+    parser.add_argument('--step', type=int, default=2, help="Step of the base 2 logarithm of the synthetic sizes")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-owid', action='store_true', help="Skip the OWID slice")
+    parser.add_argument('--history', default=history_filename, help="JSON lines file to append the results to")
+    parser.add_argument('--baseline', default=baseline_filename)
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the baseline")
+    parser.add_argument('--check', action='store_true', help="Compare with the baseline, failing on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    print("{:<20} {:<10} {:>9} {:>12} {:>12}".format('kernel', 'input', 'n', 'time [s]', 'peak [MiB]'))
+    results = run(args.kernels, args.min_log2, args.max_log2, args.step, args.repeat, not args.no_owid)
+    run_record = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': git_commit(),
+                  'python': sys.version.split()[0], 'numpy': np.__version__, 'results': results}
+    with open(args.history, 'a') as history_file:
+        history_file.write(json.dumps(run_record) + '\n')
+
+    flagged = []
+    if args.check:
+        if not os.path.isfile(args.baseline):
+            print("No baseline in", args.baseline)
+        else:
+            with open(args.baseline) as baseline_file:
+                flagged = regressions(results, json.load(baseline_file)['results'], args.tolerance)
+            for regression in flagged:
+                print("REGRESSION {key} {metric}: {value:.6g} vs {baseline:.6g} ({ratio:.2f}x)".format(**regression))
+            print("{} regressions over a tolerance of {:.0%}".format(len(flagged), args.tolerance))
+    if args.save_baseline:
+        # Keys of earlier runs not repeated here are kept:
+        baseline = {}
+        if os.path.isfile(args.baseline):
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)['results']
+        baseline.update({result_key(result): result for result in results})
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(dict(run_record, results=baseline), baseline_file, indent=1)
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+########################################################################################################################
+# Tools used by the scripts of this project. Submodules are only imported when first accessed (tools.specplus, or
+# from tools import specplus), and heavy dependencies such as matplotlib, scipy.stats or python-docx are loaded by the
+# submodules through lazy_import(), so a process only pays for the modules it actually uses.
+#
+# Written by Rian Koja to publish in a GitHub repository with specified license.
+########################################################################################################################
+
+# Standard imports:
+import importlib
+import importlib.util
+import sys
+import types
+
+
+submodules = ['batch_pipeline', 'createdocument', 'cullen_frey', 'fit_distribution', 'getdata', 'imc_sf',
+              'imc_sf_calibration', 'kde', 'mfdfa_ss', 'mfdfa_ss_core', 'mfdfa_ss_m1', 'mfdfa_ss_m2', 'mfdfa_ss_m3',
+              'print_table', 'result_cache', 'results_sink', 'rolling_spectra', 'specplus', 'surrogates']
+
+
+# Stand-in for a module that is only imported when one of its attributes is first accessed. It is not put in
+# sys.modules, so the module (and, for a submodule, its parent packages) is only executed by that first access:
+class LazyModule(types.ModuleType):
+    def __getattr__(self, attribute):
+        return getattr(importlib.import_module(self.__name__), attribute)
+
+    def __dir__(self):
+        return dir(importlib.import_module(self.__name__))
+
+
+# Return the module 'name', which is only executed when one of its attributes is first accessed. A module that is
+# already imported is returned as it is, and one whose top-level package is missing raises ModuleNotFoundError right
+# away, as an import would (looking up the spec of a submodule would import its parent, so that is left to the first
+# access):
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    top_level = name.partition('.')[0]
+    if top_level not in sys.modules and importlib.util.find_spec(top_level) is None:
+        raise ModuleNotFoundError("No module named " + repr(top_level), name=top_level)
+    return LazyModule(name)
+
+
+# Import submodules on first access (PEP 562):
+def __getattr__(name):
+    if name in submodules:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + submodules)
@@ -0,0 +1,107 @@
+########################################################################################################################
+# Run the analysis of Entry.py (histogram, Cullen-Frey, distribution fit, spectral index, singularity spectrum and
+# IMC-SF forecast) for many countries and date windows in parallel, writing the results of every country and window to
+# the results store (see results_sink) with the schema of each analysis.
+#
+# Written by Rian Koja to publish in a GitHub repository with specified license.
+########################################################################################################################
+
+# Standard imports:
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+
+# Local imports:
+from tools import getdata, cullen_frey, fit_distribution, specplus, mfdfa_ss, imc_sf, results_sink
+
+
+# The analyses draw nothing, but workers never show figures either, so they need no interactive backend:
+def init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+# Full analysis of one country and date window. Runs in a worker process, which reads the country straight from the
+# memory-mapped dataset cache, so the data is shared by every worker instead of being copied to each of them. Returns
+# the results as (analysis, values) pairs, with the fields of the schemas of results_sink:
+def analyse(country, date_ini, date_end, p, forecast_days):
+    results = []
+    try:
+        series = getdata.acquire_data(country=country, date_ini=date_ini, date_end=date_end)['new_cases'].dropna()
+        series = series.tolist()
+
+        counts, edges = np.histogram(series, bins=10)
+        results.append(('histogram', {'counts': counts, 'edges': edges}))
+        moments, _ = cullen_frey.accumulate(series)
+        results.append(('cullen_frey', {'skewness_square': float(moments.skewness()) ** 2,
+                                        'kurtosis': moments.kurtosis()}))
+        # Jobs already run in parallel, so the candidate distributions of each one are fitted in its own process:
+        ranking = fit_distribution.fit_distributions(series)
+        loc, scale = next(fit['params'] for fit in ranking if fit['family'] == 'norm')
+        results.append(('gaussian_fit', {'loc': loc, 'scale': scale}))
+        for rank, fit in enumerate(ranking):
+            results.append(('distribution_fit', {'rank': rank, 'family': fit['family'], 'params': fit.get('params'),
+                                                 **{key: fit.get(key) for key in ['aic', 'bic', 'ks_stat']}}))
+        spectral = specplus.compute(series)
+        results.append(('spectral', {'alpha': spectral.alpha, 'beta_theoretical': spectral.beta_theoretical}))
+        mfdfa_dict = mfdfa_ss.compute(series).stats
+        results.append(('mfdfa', {key: mfdfa_dict[key] for key in ['delta_alpha', 'alpha_zero', 'a_alpha']}))
+
+        model = imc_sf.RefData(date_ini=date_ini, date_end=date_end, p=p, country=country)
+        model.forecast(date_end=pd.to_datetime(date_end) + pd.Timedelta(days=forecast_days))
+        forecast_columns = ['new_cases', 'n_s_min', 'n_s_max']
+        results.append(('imc_sf_forecast', {'p': p, 'date': model.forecast_df['date'].dt.strftime('%Y-%m-%d'),
+                                            **{key: model.forecast_df[key] for key in forecast_columns}}))
+    except Exception as error:
+        results.append(('error', {'error': repr(error)}))
+    return results
+
+
+# Run every (country, date_ini, date_end) job over a process pool, writing the results of each one to the results store
+# in 'output' as it finishes. Every job of the batch shares the same run id:
+def run_batch(jobs, p=None, forecast_days=8, processes=None, output=None):
+    if p is None:
+        p = [0.5, 0.45, 0.05]
+    time_ini = time.perf_counter()
+    # Build (or validate) the dataset cache once, before the workers start reading it:
+    getdata.cache_manifest()
+
+    n_errors = 0
+    with results_sink.ResultsSink(directory=output) as sink, \
+            ProcessPoolExecutor(max_workers=processes, initializer=init_worker) as pool:
+        futures = {pool.submit(analyse, country, date_ini, date_end, p, forecast_days): (country, date_ini, date_end)
+                   for country, date_ini, date_end in jobs}
+        for future in as_completed(futures):
+            country, date_ini, date_end = futures[future]
+            for analysis, values in future.result():
+                n_errors += analysis == 'error'
+                sink.write(analysis, country=country, date_ini=date_ini, date_end=date_end, **values)
+
+    print("Analysed {} jobs ({} failed) in {:.1f} s, run {} in {}".format(
+        len(jobs), n_errors, time.perf_counter() - time_ini, sink.run_id, sink.directory))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the analysis for many countries in parallel.")
+    parser.add_argument('--countries', nargs='+', default=['all'],
+                        help="Locations to analyse, or 'all' for every location in the dataset.")
+    parser.add_argument('--windows', nargs='+', default=['2020-03-10:2020-05-28'],
+                        help="Date windows to analyse, each as date_ini:date_end.")
+    parser.add_argument('--p', nargs=3, type=float, default=[0.5, 0.45, 0.05], help="p vector of the IMC-SF model.")
+    parser.add_argument('--forecast-days', type=int, default=8, help="Days to forecast past each window.")
+    parser.add_argument('--processes', type=int, default=None, help="Worker processes, defaults to every core.")
+    parser.add_argument('--output', default=None, help="Directory of the results store, defaults to mount/results.")
+    args = parser.parse_args(argv)
+
+    countries = args.countries
+    if countries == ['all']:
+        countries = sorted(getdata.cache_manifest()['partitions'])
+    windows = [window.split(':') for window in args.windows]
+    jobs = [(country, date_ini, date_end) for country in countries for date_ini, date_end in windows]
+    run_batch(jobs, p=args.p, forecast_days=args.forecast_days, processes=args.processes, output=args.output)
+
+
+if __name__ == "__main__":
+    main()
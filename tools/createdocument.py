@@ -1,45 +1,241 @@
 ########################################################################################################################
 # Defines a class that handles writing results to a word document.
 #
+# Figures are rendered off the main thread: each one is pickled and closed as soon as it is added (or only described, by
+# a plotting function and its arguments) and rasterised to PNG in a process pool. The document is written as a stream:
+# parts are written in the order they were added as soon as they are ready, each image straight into the output zip, so
+# only the XML of the document body is kept in memory.
+#
 # Written by Rian Koja to publish in a GitHub repository with specified licence.
 ########################################################################################################################
+import importlib.util
+import io
 import os
-from docx import Document
-from docx.shared import Inches
-from pandas.compat import BytesIO
-import matplotlib.pyplot as plt
+import pickle
+import re
+import struct
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape
 
+from tools import lazy_import
+
+# matplotlib is only loaded when a figure is first added:
+plt = lazy_import('matplotlib.pyplot')
+
+# Empty document shipped with python-docx, whose styles, settings and theme are copied into every report:
+template_filename = os.path.join(importlib.util.find_spec('docx').submodule_search_locations[0], 'templates',
+                                 'default.docx')
+# Parts of the template rewritten by DocxWriter, as they change with the contents:
+generated_parts = ['[Content_Types].xml', 'word/document.xml', 'word/_rels/document.xml.rels']
+emu_per_inch = 914400
+
+# Body of an inline picture, as python-docx writes it:
+picture_xml = (
+    '<w:p><w:r><w:drawing><wp:inline distT="0" distB="0" distL="0" distR="0"><wp:extent cx="{cx}" cy="{cy}"/>'
+    '<wp:docPr id="{id}" name="Picture {id}"/><wp:cNvGraphicFramePr>'
+    '<a:graphicFrameLocks xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" noChangeAspect="1"/>'
+    '</wp:cNvGraphicFramePr><a:graphic xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main">'
+    '<a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:pic xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+    '<pic:nvPicPr><pic:cNvPr id="0" name="{name}"/><pic:cNvPicPr/></pic:nvPicPr>'
+    '<pic:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></pic:blipFill>'
+    '<pic:spPr><a:xfrm><a:off x="0" y="0"/><a:ext cx="{cx}" cy="{cy}"/></a:xfrm>'
+    '<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></pic:spPr></pic:pic></a:graphicData></a:graphic>'
+    '</wp:inline></w:drawing></w:r></w:p>')
+
+
+def init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+# PNG bytes of a figure, given either pickled (('figure', pickled_figure)) or as a function that draws it on a new
+# figure (('spec', function, args, kwargs)). Runs in the render pool:
+def render_figure(payload, dpi=None):
+    if payload[0] == 'figure':
+        fig = pickle.loads(payload[1])
+    else:
+        _, function, args, kwargs = payload
+        plt.figure()
+        function(*args, **kwargs)
+        fig = plt.gcf()
+    memfile = io.BytesIO()
+    fig.savefig(memfile, format='png', dpi=dpi)
+    plt.close('all')
+    return memfile.getvalue()
+
+
+# Next free version of the files named prefix + version + suffix in 'directory', found with a single scan of it:
+def next_version(directory, prefix, suffix):
+    pattern = re.compile(re.escape(prefix) + r'(\d+)' + re.escape(suffix) + '$')
+    try:
+        with os.scandir(directory) as entries:
+            versions = [int(match.group(1)) for match in map(pattern.match, (entry.name for entry in entries)) if match]
+    except FileNotFoundError:
+        versions = []
+    return max(versions) + 1 if versions else 0
 
-class ReportDocument:
-    def __init__(self):
-        self.document = Document()
-        self.document.add_heading('Test Handout', level=0)
-        self.document.add_heading('Rian Koja', level=1)
-        self.document.add_heading('CAP 239 Computational Mathematics', level=1)
 
+# Writes a .docx file as a stream: the static parts of the template are copied when the file is opened and each image
+# goes into the zip as soon as it is added, so only the XML of the body is kept until close(), which writes the parts
+# that depend on the contents. The file is written under a temporary name and only renamed in place when complete:
+class DocxWriter:
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.zip_file = zipfile.ZipFile(file_name + '.part', 'w', zipfile.ZIP_DEFLATED)
+        with zipfile.ZipFile(template_filename) as template:
+            for info in template.infolist():
+                if info.filename not in generated_parts:
+                    self.zip_file.writestr(info, template.read(info.filename))
+            self.template = {name: template.read(name).decode('utf-8') for name in generated_parts}
+        self.body = []
+        self.relationships = []
+
+    # A paragraph with the given style ('Title', 'Heading1', ...), with line breaks where 'text' has new lines:
+    def add_paragraph(self, text, style=None):
+        style_xml = '' if style is None else '<w:pPr><w:pStyle w:val="{}"/></w:pPr>'.format(style)
+        runs = '<w:br/>'.join('<w:t xml:space="preserve">{}</w:t>'.format(escape(line)) for line in text.split('\n'))
+        self.body.append('<w:p>{}<w:r>{}</w:r></w:p>'.format(style_xml, runs))
+
+    def add_heading(self, text, level=1):
+        self.add_paragraph(text, 'Title' if level == 0 else 'Heading{}'.format(level))
+
+    # Add a PNG picture 'width' inches wide, keeping its aspect ratio:
+    def add_picture(self, png, width):
+        index = len(self.relationships) + 1
+        name = 'image{}.png'.format(index)
+        rid = 'rIdImage{}'.format(index)
+        # Images are already compressed, so they are stored as they are:
+        self.zip_file.writestr('word/media/' + name, png, compress_type=zipfile.ZIP_STORED)
+        self.relationships.append('<Relationship Id="{}" Type="http://schemas.openxmlformats.org/officeDocument/2006/'
+                                  'relationships/image" Target="media/{}"/>'.format(rid, name))
+        # The size in pixels is in the IHDR chunk, right after the signature:
+        pixels_wide, pixels_high = struct.unpack('>II', png[16:24])
+        cx = int(width * emu_per_inch)
+        self.body.append(picture_xml.format(cx=cx, cy=int(cx * pixels_high / pixels_wide), id=index, name=name,
+                                            rid=rid))
+
+    def close(self):
+        content_types = self.template['[Content_Types].xml']
+        if 'Extension="png"' not in content_types:
+            content_types = content_types.replace('<Override', '<Default Extension="png" ContentType="image/png"/>'
+                                                  '<Override', 1)
+        self.zip_file.writestr('[Content_Types].xml', content_types)
+        self.zip_file.writestr('word/_rels/document.xml.rels', self.template['word/_rels/document.xml.rels'].replace(
+            '</Relationships>', ''.join(self.relationships) + '</Relationships>'))
+        document = self.template['word/document.xml']
+        section = document.index('<w:sectPr')
+        self.zip_file.writestr('word/document.xml', document[:section] + ''.join(self.body) + document[section:])
+        self.zip_file.close()
+        os.replace(self.file_name + '.part', self.file_name)
+
+
+class ReportDocument:
+    # 'processes' render figures in parallel (None uses every core, 0 renders them in this process as they are added),
+    # and 'dpi' is their resolution (None for matplotlib's default). At most 'max_pending' figures wait to be rendered;
+    # past that, adding one waits for the oldest:
+    def __init__(self, processes=None, dpi=None, max_pending=16):
         self.file_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'mount')
-        file_version = 0
         prefix = 'Test_Rian_v'
-        while os.path.isfile(os.path.join(self.file_path, prefix + str(file_version) + ".docx")):
-            file_version += 1
+        self.file_name = prefix + str(next_version(self.file_path, prefix, ".docx")) + ".docx"
+
+        self.processes = processes
+        self.dpi = dpi
+        self.max_pending = max_pending
+        self.pool = None
+        # The output file is only opened when the first part is written:
+        self.writer = None
+        # Parts not written yet, in order, each a (kind, content, option) tuple; a picture's content is its PNG bytes or
+        # the future that will return them:
+        self.parts = deque()
+        self.pending = deque()
+
+        self.add_heading('Test Handout', level=0)
+        self.add_heading('Rian Koja', level=1)
+        self.add_heading('CAP 239 Computational Mathematics', level=1)
+
+    # Write the parts that are ready, up to the first picture still being rendered (or all of them, waiting for their
+    # pictures, if 'wait' is set):
+    def flush(self, wait=False):
+        while self.parts:
+            kind, content, option = self.parts[0]
+            if kind == 'picture' and not isinstance(content, bytes) and not (wait or content.done()):
+                break
+            self.parts.popleft()
+            if self.writer is None:
+                self.writer = DocxWriter(os.path.join(self.file_path, self.file_name))
+            if kind == 'heading':
+                self.writer.add_heading(content, level=option)
+            elif kind == 'paragraph':
+                self.writer.add_paragraph(content)
+            else:
+                self.writer.add_picture(content if isinstance(content, bytes) else content.result(), option)
+
+    def submit(self, payload, wid):
+        if self.processes == 0:
+            picture = render_figure(payload, self.dpi)
+        else:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.processes, initializer=init_worker)
+            picture = self.pool.submit(render_figure, payload, self.dpi)
+            self.pending.append(picture)
+            # Bound the pickled figures waiting in the pool's queue, so memory stays flat on long reports:
+            while len(self.pending) > self.max_pending:
+                self.pending.popleft().result()
+            while self.pending and self.pending[0].done():
+                self.pending.popleft()
+        self.parts.append(('picture', picture, wid))
+        self.flush()
 
-        self.file_name = prefix + str(file_version) + ".docx"
+    # Add 'fig' (by default, the current figure) and close it:
+    def add_fig(self, wid=6, fig=None):
+        if fig is None:
+            fig = plt.gcf()
+        # A figure restored by result_cache already has its PNG, which is used as it is unless another dpi is asked for:
+        cached_png = getattr(fig, 'cached_png', None)
+        if cached_png is not None and self.dpi in (None, fig.dpi):
+            self.parts.append(('picture', cached_png, wid))
+            plt.close(fig)
+            self.flush()
+            return
+        try:
+            payload = ('figure', pickle.dumps(fig))
+        except Exception:
+            # Figures holding unpicklable artists are rendered right away instead:
+            memfile = io.BytesIO()
+            fig.savefig(memfile, format='png', dpi=self.dpi)
+            payload = None
+            self.parts.append(('picture', memfile.getvalue(), wid))
+        plt.close(fig)
+        if payload is None:
+            self.flush()
+        else:
+            self.submit(payload, wid)
 
-    def add_fig(self, wid=6):
-        memfile = BytesIO()
-        plt.savefig(memfile)
-        self.document.add_picture(memfile, width=Inches(wid))
-        memfile.close()
+    # Add the figure drawn by function(*args, **kwargs) on a new figure, which is only created in the render pool. The
+    # function and its arguments must be picklable (a module-level function of plain data, for instance):
+    def add_fig_spec(self, function, *args, wid=6, **kwargs):
+        self.submit(('spec', function, args, kwargs), wid)
 
+    # Write the remaining parts, waiting for their pictures, and complete the file:
     def finish(self):
-        self.document.save(os.path.join(self.file_path, self.file_name))
+        self.flush(wait=True)
+        self.pending.clear()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        self.writer.close()
+        self.writer = None
         print("finished word document file.")
 
+    # Text is small, so it is written along with the next picture:
     def add_heading(self, text, level=2):
-        self.document.add_heading(text, level=level)
+        self.parts.append(('heading', text, level))
 
     def add_paragraph(self, text):
-        self.document.add_paragraph(text)
+        self.parts.append(('paragraph', text, None))
 
 
 if __name__ == "__main__":
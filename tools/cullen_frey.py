@@ -2,15 +2,135 @@
 # Print Cullen-Frey chart
 #
 # Based on https://github.com/reinaldo-rosa-inpe/cap239/blob/master/Codigos/cullen_frey_giovanni.py
+#
+# The coordinates are computed in a single pass by a mergeable moment accumulator, so data given in chunks, by a
+# generator or split over several workers can be placed on the chart without holding it all in memory.
 ########################################################################################################################
 
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.patches import Polygon
-from scipy.stats import skew, kurtosis
+
+from tools import lazy_import, result_cache
+
+# Plotting modules are only loaded when first used:
+plt = lazy_import('matplotlib.pyplot')
+patches = lazy_import('matplotlib.patches')
+
+
+# Count, mean and central moment sums (M2, M3, M4) of a stream of values, updated chunk by chunk and merged with the
+# pairwise formulas of Pebay (2008). Each state has the given 'shape', so several weighted accumulators (for instance
+# bootstrap replicates) are updated at once:
+class MomentAccumulator:
+    def __init__(self, shape=()):
+        self.n = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.m3 = np.zeros(shape)
+        self.m4 = np.zeros(shape)
+
+    # Add the values of 'chunk', each counted 'weights' times (an array of the accumulator shape plus the chunk length):
+    def update(self, chunk, weights=None):
+        chunk = np.asarray(chunk, dtype=np.float64).ravel()
+        if len(chunk) == 0:
+            return self
+        if weights is None:
+            weights = np.ones(self.n.shape + chunk.shape)
+        other = MomentAccumulator(self.n.shape)
+        other.n = weights.sum(axis=-1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            other.mean = np.where(other.n > 0, (weights * chunk).sum(axis=-1) / other.n, 0.0)
+        deviation = chunk - other.mean[..., np.newaxis]
+        weighted = weights * deviation ** 2
+        other.m2 = weighted.sum(axis=-1)
+        weighted *= deviation
+        other.m3 = weighted.sum(axis=-1)
+        weighted *= deviation
+        other.m4 = weighted.sum(axis=-1)
+        return self.merge(other)
+
+    # Combine with the moments of another (disjoint) part of the data, in place:
+    def merge(self, other):
+        n_a, n_b = self.n, other.n
+        n = n_a + n_b
+        delta = other.mean - self.mean
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = np.where(n > 0, n_b / n, 0.0)
+            m4 = (self.m4 + other.m4 + delta ** 4 * n_a * ratio * (n_a ** 2 - n_a * n_b + n_b ** 2) / n ** 2
+                  + 6 * delta ** 2 * (n_a ** 2 * other.m2 + n_b ** 2 * self.m2) / n ** 2
+                  + 4 * delta * (n_a * other.m3 - n_b * self.m3) / n)
+            m3 = (self.m3 + other.m3 + delta ** 3 * n_a * ratio * (n_a - n_b) / n
+                  + 3 * delta * (n_a * other.m2 - n_b * self.m2) / n)
+        m2 = self.m2 + other.m2 + delta ** 2 * n_a * ratio
+        empty = n == 0
+        self.m4 = np.where(empty, 0.0, m4)
+        self.m3 = np.where(empty, 0.0, m3)
+        self.m2 = m2
+        self.mean = self.mean + delta * ratio
+        self.n = n
+        return self
+
+    # Sample (biased) skewness and Pearson kurtosis, as scipy.stats.skew and kurtosis(fisher=False) compute them:
+    def skewness(self):
+        return np.sqrt(self.n) * self.m3 / self.m2 ** 1.5
+
+    def kurtosis(self):
+        return self.n * self.m4 / self.m2 ** 2
+
+    def variance(self):
+        return self.m2 / self.n
+
+
+# Merge the accumulators of several parts of the data (for instance computed by parallel workers) into a new one:
+def combine(accumulators):
+    accumulators = list(accumulators)
+    total = MomentAccumulator(accumulators[0].n.shape)
+    for accumulator in accumulators:
+        total.merge(accumulator)
+    return total
+
+
+# Arrays of at most 'chunk_size' values from 'data': an array-like is split, while an iterable may yield arrays (used as
+# they are) or single values (gathered into chunks):
+def iter_chunks(data, chunk_size=65536):
+    if hasattr(data, '__len__'):
+        data = np.asarray(data, dtype=np.float64).ravel()
+        for first in range(0, len(data), chunk_size):
+            yield data[first:first + chunk_size]
+        return
+    pending = []
+    for item in data:
+        if np.ndim(item) == 0:
+            pending.append(item)
+            if len(pending) == chunk_size:
+                yield np.asarray(pending, dtype=np.float64)
+                pending = []
+        else:
+            if pending:
+                yield np.asarray(pending, dtype=np.float64)
+                pending = []
+            yield np.asarray(item, dtype=np.float64).ravel()
+    if pending:
+        yield np.asarray(pending, dtype=np.float64)
+
+
+# Moments of 'data' (see iter_chunks) in a single pass. With 'n_boot' > 0, also returns an accumulator of 'n_boot'
+# Poisson bootstrap replicates, in which each value is counted a Poisson(1) number of times; as this needs no second
+# pass, accumulators of shards of the data (with different seeds) can be merged as well:
+def accumulate(data, n_boot=0, seed=0, chunk_size=65536):
+    moments = MomentAccumulator()
+    replicates = MomentAccumulator((n_boot,)) if n_boot > 0 else None
+    rng = np.random.default_rng(seed)
+    for chunk in iter_chunks(data, chunk_size):
+        moments.update(chunk)
+        if replicates is not None:
+            # Blocks keep the weight array to about a million values:
+            block_size = max(1, 2 ** 20 // n_boot)
+            for first in range(0, len(chunk), block_size):
+                block = chunk[first:first + block_size]
+                replicates.update(block, rng.poisson(1.0, (n_boot, len(block))))
+    return moments, replicates
 
 
-def cullenfrey_chart(xd, yd, legend, title):
+def cullenfrey_chart(xd, yd, legend, title, boot_xd=None, boot_yd=None):
     fig, ax = plt.subplots()
     maior = max(xd) * 1.1
     poly_x1 = maior if maior > 4.4 else 4.4
@@ -24,8 +144,10 @@ def cullenfrey_chart(xd, yd, legend, title):
 
     scale = 1
     step = max([0.1, maior/1000])
-    poly = Polygon(np.c_[x, y]*scale, facecolor='#1B9AAA', edgecolor='#1B9AAA', alpha=0.5)
+    poly = patches.Polygon(np.c_[x, y]*scale, facecolor='#1B9AAA', edgecolor='#1B9AAA', alpha=0.5)
     ax.add_patch(poly)
+    if boot_xd is not None:
+        ax.plot(boot_xd, boot_yd, marker=".", c="#f4b8cb", label="bootstrapped values", linestyle='', alpha=0.6)
     ax.plot(xd, yd, marker="o", c="#e86a92", label=legend, linestyle='')
     ax.plot(0, 4.187999875999753, label="logistic", marker='+', c='black', linestyle='None')
     ax.plot(0, 1.7962675925351856, label="uniform", marker='^', c='black', linestyle='None')
@@ -45,11 +167,17 @@ def cullenfrey_chart(xd, yd, legend, title):
     plt.draw()
 
 
-def series2chart(series):
-    skewness_square = (skew(series)) ** 2
-    kurt = kurtosis(series, fisher=False)
-    print("skewness_square =", skewness_square, " and kurtosis = ", kurtosis)
-    cullenfrey_chart([skewness_square], [kurt], "Data for USA", "Daily new confirmed COVID-19 cases")
+# Place 'series' (an array-like, or an iterable of values or chunks, see iter_chunks) on the chart, with a cloud of
+# 'n_boot' bootstrap replicates around it:
+@result_cache.cached()
+def series2chart(series, legend="Data for USA", n_boot=100, seed=0):
+    moments, replicates = accumulate(series, n_boot=n_boot, seed=seed)
+    skewness_square = float(moments.skewness()) ** 2
+    kurt = float(moments.kurtosis())
+    print("skewness_square =", skewness_square, " and kurtosis = ", kurt)
+    boot_xd, boot_yd = (None, None) if replicates is None else (replicates.skewness() ** 2, replicates.kurtosis())
+    cullenfrey_chart([skewness_square], [kurt], legend, "Daily new confirmed COVID-19 cases", boot_xd, boot_yd)
+    return skewness_square, kurt
 
 
 # Example usage:
@@ -4,68 +4,186 @@
 # Written by Rian Koja to publish in a GitHub repository with specified licence.
 ########################################################################################################################
 
+# Standard imports:
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.stats import genextreme, norm, lognorm
-import seaborn as sns
+
+from tools import kde, lazy_import, result_cache
+
+# Plotting and statistics modules are only loaded when first used:
+plt = lazy_import('matplotlib.pyplot')
+stats = lazy_import('scipy.stats')
+
+
+# Families fitted by default, by their scipy.stats names:
+default_families = ['norm', 'lognorm', 'genextreme', 'gamma', 'weibull_min', 'expon', 'logistic', 'gumbel_r',
+                    'gumbel_l', 'laplace', 'cauchy', 't']
+
+# Fits already computed, keyed by a hash of the data and the family, and the number of fits kept:
+fit_cache = OrderedDict()
+fit_cache_size = 1024
+
+
+# Method of moments estimates of the parameters of a family (shapes, then loc and scale), used as the starting point of
+# the maximum likelihood fit. Returns the estimates and whether they already are the maximum likelihood ones:
+def moment_guess(family, data):
+    mean, std = np.mean(data), np.sqrt(np.mean((data - np.mean(data)) ** 2))
+    data_min, median = np.min(data), np.median(data)
+    euler_gamma = 0.5772156649015329
+    gumbel_scale = std * np.sqrt(6) / np.pi
+    # A location just below the data, for the families whose support starts at loc:
+    support_loc = data_min - 1e-3 * (std if std > 0 else 1.0)
+
+    if family == 'norm':
+        return (mean, std), True
+    if family == 'expon':
+        return (data_min, mean - data_min), True
+    if family == 'lognorm':
+        log_data = np.log(data - support_loc)
+        return (np.std(log_data), support_loc, np.exp(np.mean(log_data))), False
+    if family == 'gamma':
+        skewness = stats.skew(data)
+        shape = (2.0 / skewness) ** 2 if skewness > 0 else 1.0
+        scale = std / np.sqrt(shape)
+        return (shape, mean - shape * scale, scale), False
+    if family == 'weibull_min':
+        return (1.5, support_loc, (mean - support_loc) / 0.9), False
+    if family == 'genextreme':
+        return (0.0, mean - euler_gamma * gumbel_scale, gumbel_scale), False
+    if family == 'gumbel_r':
+        return (mean - euler_gamma * gumbel_scale, gumbel_scale), False
+    if family == 'gumbel_l':
+        return (mean + euler_gamma * gumbel_scale, gumbel_scale), False
+    if family == 'logistic':
+        return (mean, std * np.sqrt(3) / np.pi), False
+    if family == 'laplace':
+        return (median, np.mean(np.abs(data - median))), True
+    if family == 'cauchy':
+        quartiles = np.percentile(data, [25, 75])
+        return (median, (quartiles[1] - quartiles[0]) / 2.0), False
+    if family == 't':
+        excess_kurtosis = stats.kurtosis(data)
+        df = 6.0 / excess_kurtosis + 4.0 if excess_kurtosis > 0 else 30.0
+        return (df, mean, std * np.sqrt((df - 2.0) / df)), False
+    # Families without an estimate here start from scipy's own defaults:
+    return None, False
+
+
+# Maximum likelihood fit of one family, warm started from the method of moments, with its goodness of fit. Returns a
+# dictionary with the parameters, the log likelihood, AIC, BIC and the Kolmogorov-Smirnov statistic and p-value:
+def fit_family(family, data):
+    data = np.asarray(data, dtype=np.float64)
+    record = {'family': family}
+    try:
+        distribution = getattr(stats, family)
+        guess, exact = moment_guess(family, data)
+        if guess is None:
+            params = distribution.fit(data)
+        elif exact:
+            params = guess
+        else:
+            params = distribution.fit(data, *guess[:-2], loc=guess[-2], scale=guess[-1])
+        params = tuple(float(value) for value in params)
+        log_likelihood = float(np.sum(distribution.logpdf(data, *params)))
+        ks_stat, ks_pvalue = stats.kstest(data, family, args=params)
+        record.update(params=params, log_likelihood=log_likelihood,
+                      aic=2 * len(params) - 2 * log_likelihood,
+                      bic=len(params) * np.log(len(data)) - 2 * log_likelihood,
+                      ks_stat=float(ks_stat), ks_pvalue=float(ks_pvalue))
+    except Exception as error:
+        record.update(error=repr(error), aic=np.inf, bic=np.inf, ks_stat=np.inf)
+    return record
+
+
+def data_hash(data):
+    return hashlib.sha1(np.ascontiguousarray(data, dtype=np.float64).view(np.uint8)).hexdigest()
+
+
+# Fit 'families' to each series of 'series_list', ranking the fits of each series by 'rank_by' ('aic', 'bic' or
+# 'ks_stat'), best first. Fits not in the cache are spread over a pool of 'processes' processes (None uses every core,
+# 0 runs in this process):
+def fit_many(series_list, families=None, rank_by='aic', processes=None, use_cache=True):
+    if families is None:
+        families = default_families
+    series_list = [np.asarray(series, dtype=np.float64) for series in series_list]
+    hashes = [data_hash(series) for series in series_list]
+
+    fits = {}
+    pending = OrderedDict()
+    for idx, series in enumerate(series_list):
+        for family in families:
+            key = (hashes[idx], family)
+            if use_cache and key in fit_cache:
+                fit_cache.move_to_end(key)
+                fits[key] = fit_cache[key]
+            else:
+                pending[key] = (family, series)
+    pending = [(key, family, series) for key, (family, series) in pending.items()]
+
+    if pending:
+        if processes == 0 or len(pending) == 1:
+            records = [fit_family(family, series) for _, family, series in pending]
+        else:
+            # Fits are short, so they are sent to the workers in a few chunks each:
+            chunk_size = max(1, len(pending) // (4 * (processes or os.cpu_count() or 1)))
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                records = list(pool.map(fit_family, [task[1] for task in pending], [task[2] for task in pending],
+                                        chunksize=chunk_size))
+        for (key, _, _), record in zip(pending, records):
+            fits[key] = record
+            if use_cache:
+                fit_cache[key] = record
+        while len(fit_cache) > fit_cache_size:
+            fit_cache.popitem(last=False)
+
+    return [sorted([fits[(series_hash, family)] for family in families], key=lambda record: record[rank_by])
+            for series_hash in hashes]
+
+
+# Fit 'families' to a single series (see fit_many):
+def fit_distributions(data_sample, families=None, rank_by='aic', processes=0, use_cache=True):
+    return fit_many([data_sample], families=families, rank_by=rank_by, processes=processes, use_cache=use_cache)[0]
 
 
 # Example usage:
+@result_cache.cached(depends=('tools.kde',))
 def plot_ks_gev_gauss(data_sample, alg_name):
     data_min = min(data_sample)
     data_max = max(data_sample)
     n_points = 100
     plot_points = [(data_min + (i/n_points) * (data_max-data_min)) for i in range(0, n_points+1)]
-
-    # Estimate gaussian:
-    nrm_fit = norm.fit(data_sample)
-    # GEV parameters from fit:
-    (mu, sigma) = nrm_fit
-    rv_nrm = norm(loc=mu, scale=sigma)
-    # Create data from estimated GEV to plot:
+    # Only the Gaussian is drawn, so it is the only family fitted (the full ranking is given by fit_distributions):
+    (mu, sigma) = fit_distributions(data_sample, ['norm'])[0]['params']
+    rv_nrm = stats.norm(loc=mu, scale=sigma)
+    # Create data from estimated Gaussian to plot:
     nrm_pdf = rv_nrm.pdf(plot_points)
 
-    # Estimate GEV:
-    gev_fit = genextreme.fit(data_sample)
-    # GEV parameters from fit:
-    c, loc, scale = gev_fit
-    rv_gev = genextreme(c, loc=loc, scale=scale)
-    # Create data from estimated GEV to plot:
-    gev_pdf = rv_gev.pdf(plot_points)
-
-    # Estimate Lognormal:
-    lgn_fit = lognorm.fit(data_sample)
-    # GEV parameters from fit:
-    s, lol, scall = lgn_fit
-    rv_lgn = lognorm(c, loc=lol, scale=scall)
-    # Create data from estimated GEV to plot:
-    lng_pdf = rv_lgn.pdf(plot_points)
-
-    # Make a Kernel density plot and add other fits:
-    sns.set(color_codes=True)
+    # Make a Kernel density plot and add the fit:
     plt.figure()
-    ax = sns.kdeplot(data_sample, label='Kernel Density')
-    # ax.plot(plot_points, gev_pdf, label='Estimated GEV') # looks awful.
+    ax = kde.plot_kde(*kde.kde(data_sample))
     ax.plot(plot_points, nrm_pdf, label='Estimated Gaussian')
-    #ax.plot(plot_points, lng_pdf, label='Estimated Lognormal')
     ax.legend()
 
     # Use title to indicate parameters found:
     plot_title = "PDF estimated from data created with " + alg_name + "\n"
-    #plot_title += "Estimated parameters for GEV: location={:.2f} scale={:.2f} c={:.2f}\n".format(loc, scale, c)
     plot_title += "Estimated parameters for Gaussian: location={:.2f} scale={:.2f}\n".format(mu, sigma)
-    #plot_title += "Estimated parameters for Lognorm: shape={:.2f} location={:.2f} scale={:.2f}\n".format(s, lol, scall)
 
     plt.title(plot_title)
     plt.xlabel("Independent Variable")
     plt.ylabel("Probability Density from " + str(len(data_sample)) + " points")
     plt.tight_layout()
     plt.draw()
+    return mu, sigma
 
 
 if __name__ == '__main__':
     mean, cov = [0, 2], [(1, .5), (.5, 1)]
     series, y = np.random.multivariate_normal(mean, cov, size=100).T
     plot_ks_gev_gauss(series, 'example np.random')
+    for ranked_fit in fit_distributions(series):
+        print(ranked_fit['family'], ranked_fit['aic'], ranked_fit['ks_stat'])
 
     plt.show()
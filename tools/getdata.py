@@ -5,21 +5,171 @@
 ########################################################################################################################
 
 # Standard imports:
-import pandas as pd
+import json
 import os
+import time
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
 
 
-# Use this function to yield the dataframe to be analyzed.
-def acquire_data(country='United States', date_ini='2020-03-10', date_end='2020-05-28'):
-    xls_filename = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'mount', 'covid-19-data', 'public',
-                                'data', 'owid-covid-data.xlsx')
+# Locations of the source data and of the columnar cache built from it:
+mount_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'mount')
+xls_filename = os.path.join(mount_dir, 'covid-19-data', 'public', 'data', 'owid-covid-data.xlsx')
+csv_url = 'https://raw.githubusercontent.com/owid/covid-19-data/master/public/data/owid-covid-data.csv'
+cache_dir = os.path.join(mount_dir, 'owid_cache')
+manifest_filename = os.path.join(cache_dir, 'manifest.json')
+# A downloaded file has no modification time to check, so a cache built from the remote csv expires after a day:
+remote_max_age = 24 * 3600
+
 
+# Read the whole OWID dataset, preferring the local spreadsheet:
+def read_source():
     if os.path.isfile(xls_filename):  # Read the csv file:
         df = pd.read_excel(xls_filename)
     else:
-        url = 'https://raw.githubusercontent.com/owid/covid-19-data/master/public/data/owid-covid-data.csv'
-        df = pd.read_csv(url, index_col=0)
+        df = pd.read_csv(csv_url, index_col=0)
+    return df
+
+
+# Identify the current version of the source, so the cache knows when it has to be rebuilt:
+def source_signature():
+    if os.path.isfile(xls_filename):
+        stat = os.stat(xls_filename)
+        return {'source': os.path.realpath(xls_filename), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+    return {'source': csv_url, 'period': int(time.time() // remote_max_age)}
+
+
+# Split the dataset by location and store each one as a pair of numpy arrays (dates and new cases), which can later be
+# memory-mapped so only the requested country is ever touched:
+def build_cache(df=None, signature=None):
+    if signature is None:
+        signature = source_signature()
+    if df is None:
+        df = read_source()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    dates = pd.to_datetime(df['date']).values.astype('datetime64[D]')
+    new_cases = df['new_cases'].values.astype(np.float64)
+
+    # Write every partition under a temporary name and rename it in place, so readers never see half-written files:
+    partitions = {}
+    for idx, (location, rows) in enumerate(sorted(df.groupby('location').indices.items())):
+        order = np.argsort(dates[rows], kind='stable')
+        stem = 'loc{:04d}'.format(idx)
+        for column, values in (('date', dates[rows][order]), ('new_cases', new_cases[rows][order])):
+            file_name = os.path.join(cache_dir, stem + '.' + column + '.npy')
+            np.save(file_name + '.tmp.npy', values)
+            os.replace(file_name + '.tmp.npy', file_name)
+        partitions[location] = stem
+
+    # The manifest is written last, so its presence means the cache is complete:
+    with open(manifest_filename + '.tmp', 'w') as manifest_file:
+        json.dump({'signature': signature, 'partitions': partitions}, manifest_file)
+    os.replace(manifest_filename + '.tmp', manifest_filename)
+    return partitions
+
+
+# Return the cache manifest, rebuilding the cache first if it is missing or older than the source:
+def cache_manifest():
+    signature = source_signature()
+    if os.path.isfile(manifest_filename):
+        with open(manifest_filename) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest['signature'] == signature:
+            return manifest
+    return {'signature': signature, 'partitions': build_cache(signature=signature)}
+
+
+# Memory-map the cached arrays of a single location:
+def load_partition(country, manifest=None):
+    if manifest is None:
+        manifest = cache_manifest()
+    stem = manifest['partitions'].get(country)
+    if stem is None:
+        return np.array([], dtype='datetime64[D]'), np.array([], dtype=np.float64)
+    dates = np.load(os.path.join(cache_dir, stem + '.date.npy'), mmap_mode='r')
+    new_cases = np.load(os.path.join(cache_dir, stem + '.new_cases.npy'), mmap_mode='r')
+    return dates, new_cases
+
+
+# Process-wide memoization of the cached dataset. Full per-location frames and the (country, date_ini, date_end)
+# slices taken from them are kept in least-recently-used order, and the oldest entries are dropped once 'max_bytes' is
+# exceeded. Entries are discarded automatically when the source changes, or explicitly through invalidate().
+class DatasetLoader:
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.slices = OrderedDict()
+        self.n_bytes = 0
+        self.signature = None
+        self.counters = {'frame_hits': 0, 'frame_misses': 0, 'slice_hits': 0, 'slice_misses': 0}
+
+    def full_frame(self, country):
+        self.check_source()
+        if country in self.frames:
+            self.counters['frame_hits'] += 1
+            self.frames.move_to_end(country)
+            return self.frames[country]
+        self.counters['frame_misses'] += 1
+        dates, new_cases = load_partition(country)
+        df = pd.DataFrame({'date': np.array(dates), 'new_cases': np.array(new_cases)})
+        self.store(self.frames, country, df)
+        return df
+
+    def get(self, country='United States', date_ini='2020-03-10', date_end='2020-05-28'):
+        self.check_source()
+        key = (country, str(date_ini), str(date_end))
+        if key in self.slices:
+            self.counters['slice_hits'] += 1
+            self.slices.move_to_end(key)
+            return self.slices[key]
+        self.counters['slice_misses'] += 1
+        full = self.full_frame(country)
+        # Dates are sorted within a partition, so the interval is found by bisection:
+        dates = full['date'].values
+        first = np.searchsorted(dates, np.datetime64(date_ini), side='left')
+        last = np.searchsorted(dates, np.datetime64(date_end) + np.timedelta64(1, 'D'), side='left')
+        df = full.iloc[first:last].reset_index(drop=True)
+        self.store(self.slices, key, df)
+        return df
+
+    def store(self, cache, key, df):
+        cache[key] = df
+        self.n_bytes += int(df.memory_usage(index=True).sum())
+        # Evict slices before full frames, since slices are cheap to rebuild from a frame still in memory:
+        for victims in (self.slices, self.frames):
+            while self.n_bytes > self.max_bytes and len(victims) > 0 and not (victims is cache and len(cache) == 1):
+                _, old = victims.popitem(last=False)
+                self.n_bytes -= int(old.memory_usage(index=True).sum())
+
+    def check_source(self):
+        signature = source_signature()
+        if signature != self.signature:
+            self.invalidate()
+            self.signature = signature
+
+    def invalidate(self, country=None):
+        for key in [k for k in self.frames if country is None or k == country]:
+            self.n_bytes -= int(self.frames.pop(key).memory_usage(index=True).sum())
+        for key in [k for k in self.slices if country is None or k[0] == country]:
+            self.n_bytes -= int(self.slices.pop(key).memory_usage(index=True).sum())
+
+    def stats(self):
+        return dict(self.counters, n_bytes=self.n_bytes, n_frames=len(self.frames), n_slices=len(self.slices))
+
+
+# Loader shared by every caller in this process:
+loader = DatasetLoader()
+
+
+# Use this function to yield the dataframe to be analyzed.
+def acquire_data(country='United States', date_ini='2020-03-10', date_end='2020-05-28', use_cache=True):
+    if use_cache:
+        # Return a copy, since callers are free to add columns to the frame they get:
+        return loader.get(country, date_ini, date_end).copy()
 
+    df = read_source()
     # Separate country data:
     df = df[df.location == country]
     # Separate date interval:
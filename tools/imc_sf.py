@@ -5,12 +5,17 @@
 ########################################################################################################################
 
 # Standard imports:
+from collections import namedtuple
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 
 # Local imports:
-from tools import getdata
+from tools import getdata, result_cache
+
+
+# Results of main(), as computed by compute() and drawn by render(). 'history' and 'forecast' are the df and forecast_df
+# frames of the fitted RefData, 'comparison' is the data for the forecast period:
+ImcSfResult = namedtuple('ImcSfResult', ['p', 'country', 'history', 'comparison', 'forecast'])
 
 
 # Use a function to define initial g and s:
@@ -20,78 +25,229 @@ def ims_sf_init():
     return g0, s0
 
 
+# Equations 6 and 7 of the model, for arrays of cases and moving averages:
+def ims_sf_gain(n_kt, n_nb_7ra):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(n_kt > n_nb_7ra,
+                        np.where(n_kt > 0, n_nb_7ra / n_kt, 0.0),
+                        np.where(n_nb_7ra > 1e-10, n_kt / n_nb_7ra, 0.0))
+
+
+# Array version of RefData.ims_sf_master_equation. The entries of p are taken along its last axis and the remaining
+# arguments are broadcast against them. Every operation is the same, in the same order, as in the scalar version, so
+# both give bit for bit identical results:
+def ims_sf_master_equation_array(p, n_kt, n_nb_7ra, g0):
+    p = np.asarray(p, dtype=np.float64)
+    p1 = p[..., 0]
+    p2 = p[..., 1]
+    p3 = p[..., 2]
+
+    # Equations 3, 4 and 5:
+    n1 = p1 * n_kt
+    n2 = p2 * n_kt
+    n3 = p3 * n_kt
+
+    # Equations 6 and 7:
+    g = ims_sf_gain(n_kt, n_nb_7ra)
+
+    # Computing derivatives of g:
+    delta_g = np.where(g0 < g, (g0 - g) - (1 - g) ** 2, (g0 - g) + (1 - g0) ** 2)
+
+    # Equation 1:
+    n_s_min = g * (1 * n1 + 3 * n2 + 5 * n3) / 1
+
+    # Equation 2:
+    n_s_max = g * (2 * n1 + 4 * n2 + 6 * n3) / 1
+
+    # Equation 8: Use a min to prevent singularity (written as min() would pick it, for NaN inputs):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        delta_nk = (n_nb_7ra - n_kt) / n_kt
+    delta_nk = np.where(n_kt < delta_nk, n_kt, delta_nk)
+
+    # Equation 9:
+    s = (2 * delta_g + delta_nk) / 3.0
+
+    return g, s, n_s_min, n_s_max
+
+
+# Propagate the model for 'days' days past the end of 'history' (a RefData.df frame) for every row of the (M, 3) array
+# 'p' at once. Returns a dictionary of (M, days) arrays with the forecast g, s, n_s_min, n_s_max, new_cases and
+# new_cases_7ra. The moving average is kept in a ring buffer holding the partial sums of the next seven days, so each
+# new day is added to all of them with a single vectorized operation:
+def ims_sf_forecast_batch(history, p, days):
+    p = np.atleast_2d(np.asarray(p, dtype=np.float64))
+    hist_cases = history['new_cases'].values.astype(np.float64)
+    hist_g = history['g'].values
+    forecast = {key: np.zeros((p.shape[0], days)) for key in ['g', 's', 'n_s_min', 'n_s_max', 'new_cases',
+                                                              'new_cases_7ra']}
+
+    # Initialize first day from the last day of data, with g and s as the average of the previous week:
+    g, s, n_s_min, n_s_max = ims_sf_master_equation_array(p, hist_cases[-1], history['new_cases_7ra'].values[-1],
+                                                          hist_g[-1])
+    forecast['g'][:, 0] = hist_g[-8:-1].mean()
+    forecast['s'][:, 0] = history['s'].values[-8:-1].mean()
+    forecast['n_s_min'][:, 0] = n_s_min
+    forecast['n_s_max'][:, 0] = n_s_max
+    forecast['new_cases'][:, 0] = (n_s_max + n_s_min) / 2
+
+    # Initialize moving average, slot kk % 7 of the ring holds the partial sum of day kk:
+    ring = np.zeros((p.shape[0], 7))
+    for kk in range(0, 7):
+        ring[:, kk] = sum(hist_cases[-8 + kk:-1]) / 7.0
+
+    # Perform propagation with self-updating g:
+    for ii in range(1, days):
+        # The average of the previous day is complete, so its slot is released for day ii + 6:
+        forecast['new_cases_7ra'][:, ii - 1] = ring[:, (ii - 1) % 7]
+        ring[:, (ii - 1) % 7] = 0.0
+        g, s, n_s_min, n_s_max = ims_sf_master_equation_array(p, forecast['new_cases'][:, ii - 1],
+                                                              forecast['new_cases_7ra'][:, ii - 1],
+                                                              forecast['g'][:, ii - 1])
+        forecast['g'][:, ii] = g
+        forecast['s'][:, ii] = s
+        forecast['n_s_min'][:, ii] = n_s_min
+        forecast['n_s_max'][:, ii] = n_s_max
+        forecast['new_cases'][:, ii] = (n_s_max + n_s_min) / 2
+        ring += forecast['new_cases'][:, ii:ii + 1] / 7.0
+    if days > 0:
+        forecast['new_cases_7ra'][:, days - 1] = ring[:, (days - 1) % 7]
+
+    return forecast
+
+
 class RefData:
-    def __init__(self, date_ini=None, date_end=None, p=None):
+    # Number of final rows of the history that the recurrence, the moving averages and the forecast depend on, which is
+    # what state() keeps:
+    state_rows = 8
+
+    def __init__(self, date_ini=None, date_end=None, p=None, country='United States'):
         if p is None:
             self.p = [0.5, 0.45, 0.05]
         else:
             self.p = p
-        if date_ini is None and date_end is None:
-            self.df = getdata.acquire_data()  # Using default settings
-        elif date_ini is None:
-            self.df = getdata.acquire_data(date_end=date_end)
-        elif date_end is None:
-            self.df = getdata.acquire_data(date_ini=date_ini)
-        else:
-            self.df = getdata.acquire_data(date_ini=date_ini, date_end=date_end)
+        self.country = country
+        # Use default settings for the dates not given:
+        dates = {}
+        if date_ini is not None:
+            dates['date_ini'] = date_ini
+        if date_end is not None:
+            dates['date_end'] = date_end
+        self.df = getdata.acquire_data(country=country, **dates)
 
         # Typecast dates to datetime, to facilitate plotting:
         self.df['date'] = pd.to_datetime(self.df['date'])
+        self.fill_model(0)
+
+        # Create a forecast dataframe:
+        self.forecast_df = None
+        self.forecast_end = None
+
+    # Compute the model columns of the rows of df from 'first' on, from the columns of the rows before it:
+    def fill_model(self, first):
+        n_rows = len(self.df)
+        for column in ['new_cases_7ra', 'g', 's', 'n_s_min', 'n_s_max', 'n_s_avg', 'g_7ra', 's_7ra']:
+            if column not in self.df:
+                self.df[column] = np.nan
+        if first >= n_rows:
+            return
+        # Rows needed to complete the seven day windows of the first new rows:
+        window_ini = max(first - 6, 0)
+
         # Add seven day rolling average:
-        self.df['new_cases_7ra'] = self.df['new_cases'].rolling(7, min_periods=1).mean()
-        # Initialize new columns:
+        self.df.loc[first:, 'new_cases_7ra'] = self.rolling_mean('new_cases', window_ini, first)
+        # Run the master equation over the new rows at once. Each row is computed from the previous one, but g only
+        # depends on the data, so the previous g of every row is known before s is evaluated:
         g0, s0 = ims_sf_init()
-        self.df.at[0, 'g'] = g0
-        self.df.at[0, 's'] = s0
-        self.df.at[0, 'n_s_min'] = self.df.iloc[0]['new_cases']
-        self.df.at[0, 'n_s_max'] = self.df.iloc[0]['new_cases']
-        for ii in range(1, len(self.df)):
-            g, s, n_s_min, n_s_max = self.ims_sf_master_equation(self.df.iloc[ii-1]['new_cases'],
-                                                                 self.df.iloc[ii-1]['new_cases_7ra'],
-                                                                 self.df.iloc[ii-1]['g'])
-            self.df.at[ii, 'g'] = g
-            self.df.at[ii, 's'] = s
-            self.df.at[ii, 'n_s_min'] = n_s_min
-            self.df.at[ii, 'n_s_max'] = n_s_max
+        n_kt = self.df['new_cases'].values.astype(np.float64)
+        n_nb_7ra = self.df['new_cases_7ra'].values.astype(np.float64)
+        rows = np.arange(max(first, 1), n_rows)
+        g_prev = np.where(rows >= 2, ims_sf_gain(n_kt[np.maximum(rows - 2, 0)], n_nb_7ra[np.maximum(rows - 2, 0)]), g0)
+        g, s, n_s_min, n_s_max = ims_sf_master_equation_array(self.p, n_kt[rows - 1], n_nb_7ra[rows - 1], g_prev)
+        # Initialize first row and write the new columns:
+        if first == 0:
+            g, s = np.concatenate(([g0], g)), np.concatenate(([s0], s))
+            n_s_min, n_s_max = np.concatenate((n_kt[:1], n_s_min)), np.concatenate((n_kt[:1], n_s_max))
+        self.df.loc[first:, 'g'] = g
+        self.df.loc[first:, 's'] = s
+        self.df.loc[first:, 'n_s_min'] = n_s_min
+        self.df.loc[first:, 'n_s_max'] = n_s_max
 
         # Create average column
-        self.df['n_s_avg'] = self.df.apply(lambda row: (row.n_s_min+row.n_s_max)/2, axis=1)
-        self.df['g_7ra'] = self.df['g'].rolling(7, min_periods=1).mean()
-        self.df['s_7ra'] = self.df['s'].rolling(7, min_periods=1).mean()
+        self.df.loc[first:, 'n_s_avg'] = (self.df['n_s_min'].values[first:] + self.df['n_s_max'].values[first:]) / 2
+        self.df.loc[first:, 'g_7ra'] = self.rolling_mean('g', window_ini, first)
+        self.df.loc[first:, 's_7ra'] = self.rolling_mean('s', window_ini, first)
 
-        # Create a forecast dataframe:
-        self.forecast_df = None
+    # Seven day rolling average of a column of df, for the rows from 'first' on, using the rows from 'window_ini' on:
+    def rolling_mean(self, column, window_ini, first):
+        return self.df[column].iloc[window_ini:].rolling(7, min_periods=1).mean().values[first - window_ini:]
+
+    # Add the rows of 'observations' (a frame with the 'date' and 'new_cases' columns, as given by getdata) dated after
+    # the end of the history, computing the model only for them. Returns the number of rows added:
+    def append(self, observations):
+        observations = pd.DataFrame(observations)[['date', 'new_cases']].copy()
+        observations['date'] = pd.to_datetime(observations['date'])
+        if len(self.df) > 0:
+            observations = observations[observations['date'] > self.df.iloc[-1]['date']]
+        if len(observations) == 0:
+            return 0
+        first = len(self.df)
+        self.df = pd.concat([self.df, observations.sort_values('date')], ignore_index=True)
+        self.fill_model(first)
+        return len(observations)
+
+    # Append the data available from getdata for the days after the end of the history, up to date_end:
+    def update(self, date_end):
+        date_ini = self.df.iloc[-1]['date'] + np.timedelta64(1, 'D')
+        return self.append(getdata.acquire_data(country=self.country, date_ini=date_ini.strftime('%Y-%m-%d'),
+                                                date_end=date_end))
+
+    # Redo the last forecast from the end of the current history, up to the same end date (or to 'date_end'):
+    def refresh_forecast(self, date_end=None):
+        if date_end is None:
+            if self.forecast_end is None:
+                raise ValueError("refresh_forecast() needs a date_end when no forecast has been made yet")
+            date_end = self.forecast_end
+        self.forecast(date_end=date_end)
+
+    # Serialisable (JSON compatible) state, from which from_state() rebuilds an object that appends and forecasts as
+    # this one does. Only the last state_rows rows of the history are kept, with missing values (NaN, which is not valid
+    # JSON) written as None:
+    def state(self):
+        tail = self.df.iloc[-self.state_rows:]
+        return {'p': [float(value) for value in self.p], 'country': self.country,
+                'forecast_end': None if self.forecast_end is None else str(self.forecast_end),
+                'history': {'date': tail['date'].dt.strftime('%Y-%m-%d').tolist(),
+                            **{column: [value if np.isfinite(value) else None for value in tail[column].astype(float)]
+                               for column in tail.columns if column != 'date'}}}
+
+    @classmethod
+    def from_state(cls, state):
+        obj = cls.__new__(cls)
+        obj.p = list(state['p'])
+        obj.country = state['country']
+        obj.df = pd.DataFrame(state['history'])
+        obj.df['date'] = pd.to_datetime(obj.df['date'])
+        for column in obj.df.columns.drop('date'):
+            obj.df[column] = obj.df[column].astype(float)
+        obj.forecast_df = None
+        obj.forecast_end = state['forecast_end']
+        return obj
 
     def forecast(self, date_end='2020-06-05'):
-        date_last = self.df.iloc[-1]['date']
-        days_to_propagate = int((pd.to_datetime(date_end) - date_last) / np.timedelta64(1, 'D'))
+        self.forecast_end = date_end
+        days_to_propagate = self.days_until(date_end)
+        forecast = ims_sf_forecast_batch(self.df, [self.p], days_to_propagate)
         self.forecast_df = pd.DataFrame({'date': pd.date_range(self.df.iloc[-1]['date'] + np.timedelta64(1, 'D'),
                                                                periods=days_to_propagate, freq='D')})
-        # Initialize new columns:
-        g, s, n_s_min, n_s_max = self.ims_sf_master_equation(self.df.iloc[-1]['new_cases'],
-                                                             self.df.iloc[-1]['new_cases_7ra'],
-                                                             self.df.iloc[-1]['g'])
-        self.forecast_df['g'] = self.df.iloc[-8:-1]['g'].values.mean()
-        self.forecast_df['s'] = self.df.iloc[-8:-1]['s'].values.mean()
-        self.forecast_df['n_s_min'] = n_s_min
-        self.forecast_df['n_s_max'] = n_s_max
-        self.forecast_df['new_cases'] = (n_s_max + n_s_min)/2
-        # Initialize moving average:
-        self.forecast_df['new_cases_7ra'] = 0
-        for kk in range(0, 7):
-            self.forecast_df.at[kk, 'new_cases_7ra'] = sum(self.df.iloc[-8+kk:-1]['new_cases'].values) / 7.0
-        # Perform propagation with self-updating g:
-        for ii in range(1, days_to_propagate):
-            g, s, n_s_min, n_s_max = self.ims_sf_master_equation(self.forecast_df.iloc[ii-1]['new_cases'],
-                                                                 self.forecast_df.iloc[ii-1]['new_cases_7ra'],
-                                                                 self.forecast_df.iloc[ii-1]['g'])
-            self.forecast_df.at[ii, 'g'] = g
-            self.forecast_df.at[ii, 's'] = s
-            self.forecast_df.at[ii, 'n_s_min'] = n_s_min
-            self.forecast_df.at[ii, 'n_s_max'] = n_s_max
-            self.forecast_df.at[ii, 'new_cases'] = (n_s_max + n_s_min)/2
-            for nn in range(0, min(7, days_to_propagate-ii)):
-                self.forecast_df.at[ii + nn, 'new_cases_7ra'] += self.forecast_df.iloc[ii]['new_cases'] / 7.0
+        for key in ['g', 's', 'n_s_min', 'n_s_max', 'new_cases', 'new_cases_7ra']:
+            self.forecast_df[key] = forecast[key][0]
+
+    # Propagate the same history for many p vectors, given as an (M, 3) array:
+    def forecast_batch(self, p_array, date_end='2020-06-05'):
+        return ims_sf_forecast_batch(self.df, p_array, self.days_until(date_end))
+
+    def days_until(self, date_end):
+        return int((pd.to_datetime(date_end) - self.df.iloc[-1]['date']) / np.timedelta64(1, 'D'))
 
     # Master equation for the model:
     def ims_sf_master_equation(self, n_kt, n_nb_7ra, g0=0.5):
@@ -140,35 +296,45 @@ class RefData:
         return g, s, n_s_min, n_s_max
 
 
-def main(date_end='2020-06-13', p=None, doc=None):
+def compute(date_end='2020-06-13', p=None, country='United States'):
     if p is None:
         p = [0.5, 0.45, 0.05]
     # Get data:
-    data_test = RefData(p=p)
-    data_comp = RefData(date_ini='2020-05-21', date_end=date_end, p=p)
+    data_test = RefData(p=p, country=country)
+    data_comp = RefData(date_ini='2020-05-21', date_end=date_end, p=p, country=country)
     # Slice beginning of data_comp data so the moving average is contiguous to what it was before:
     data_comp.df = data_comp.df.drop(data_comp.df.index[0:7])
 
     # Create propagation:
     data_test.forecast(date_end=date_end)
 
+    return ImcSfResult(p, country, data_test.df, data_comp.df, data_test.forecast_df)
+
+
+# Plot the results of compute(), adding each chart to doc if it is given:
+def render(result, doc=None):
+    # Plotting is optional, so matplotlib is only imported here:
+    import matplotlib.pyplot as plt
+    p = result.p
+    country = result.country
+
     # Make plot for new cases:
     cols_plot = ['new_cases', 'n_s_avg', 'new_cases_7ra']
-    ax = data_test.df.plot(x='date', y=cols_plot, label=[r'$N_{kt}$', r'$N_{s_{avg}}$', r'$<N_{nb}>_{7}$'],
-                           color=['g', 'c', 'y'])
-    ax.fill_between(data_test.df['date'].values, data_test.df['n_s_min'], data_test.df['n_s_max'], alpha=0.2,
+    ax = result.history.plot(x='date', y=cols_plot, label=[r'$N_{kt}$', r'$N_{s_{avg}}$', r'$<N_{nb}>_{7}$'],
+                             color=['g', 'c', 'y'])
+    ax.fill_between(result.history['date'].values, result.history['n_s_min'], result.history['n_s_max'], alpha=0.2,
                     label=r'$N_{min}$ $N_{max}$ band')
     # Add comparison data (labelled future)
-    data_comp.df.plot(x='date', y=['new_cases', 'new_cases_7ra'], ax=ax,
-                      label=[r'$N_{kt}$ ("future")', r'$<N_{nb}>_{7}$ ("future")'])
+    result.comparison.plot(x='date', y=['new_cases', 'new_cases_7ra'], ax=ax,
+                           label=[r'$N_{kt}$ ("future")', r'$<N_{nb}>_{7}$ ("future")'])
     # Add forecast data:
-    data_test.forecast_df.plot(x='date', y=['new_cases', 'new_cases_7ra'], linestyle='--', color=['c', 'y'],
-                               label=[r'$\widehat{N_{kt}}$', r'$\widehat{<N_{nb}>_{7}}$'], ax=ax)
-    ax.fill_between(data_test.forecast_df['date'].values, data_test.forecast_df['n_s_min'],
-                    data_test.forecast_df['n_s_max'], alpha=0.2, label=r'$N_{min}$ $N_{max}$ forecast band', color='g')
+    result.forecast.plot(x='date', y=['new_cases', 'new_cases_7ra'], linestyle='--', color=['c', 'y'],
+                         label=[r'$\widehat{N_{kt}}$', r'$\widehat{<N_{nb}>_{7}}$'], ax=ax)
+    ax.fill_between(result.forecast['date'].values, result.forecast['n_s_min'], result.forecast['n_s_max'], alpha=0.2,
+                    label=r'$N_{min}$ $N_{max}$ forecast band', color='g')
     # Format chart:
     plt.grid('both')
-    plt.title("New Cases of COVID-19 in US\nData and Forecasting p = " + str(p))
+    plt.title("New Cases of COVID-19 in " + country + "\nData and Forecasting p = " + str(p))
     plt.ylabel('Number of new cases')
     plt.legend(loc='center left', bbox_to_anchor=(1, 0.5))
     plt.tight_layout()
@@ -177,11 +343,11 @@ def main(date_end='2020-06-13', p=None, doc=None):
         doc.add_fig()
 
     # Plot g(t) and s(t) curves:
-    ax_gs = data_test.df.plot(x='date', y=['g', 's'], label=[r'$g(t)$', r'$s(t)$'], color=['r', 'g'])
-    data_test.df.plot(x='date', y=['g_7ra', 's_7ra'], label=[r'$<g(t)>_7$', r'$<s(t)>_7$'],  ax=ax_gs, color=['r', 'g'],
-                      linestyle='--')
-    data_test.forecast_df.plot(x='date', y=['g', 's'], label=[r'$\widehat{g(t)}$', r'$\widehat{s(t)}$'],
-                               color=['purple', 'blue'], ax=ax_gs)
+    ax_gs = result.history.plot(x='date', y=['g', 's'], label=[r'$g(t)$', r'$s(t)$'], color=['r', 'g'])
+    result.history.plot(x='date', y=['g_7ra', 's_7ra'], label=[r'$<g(t)>_7$', r'$<s(t)>_7$'], ax=ax_gs,
+                        color=['r', 'g'], linestyle='--')
+    result.forecast.plot(x='date', y=['g', 's'], label=[r'$\widehat{g(t)}$', r'$\widehat{s(t)}$'],
+                         color=['purple', 'blue'], ax=ax_gs)
     plt.grid('both')
     plt.title(r'$g(t)$, $s(t)$ and 7 day moving averages. p = ' + str(p))
     plt.legend()
@@ -190,6 +356,19 @@ def main(date_end='2020-06-13', p=None, doc=None):
         doc.add_fig()
 
 
+# Hash of the data compute() reads, so a cached result is only reused while its country's data is unchanged:
+def data_inputs(date_end='2020-06-13', p=None, doc=None, country='United States'):
+    return [result_cache.digest(getdata.acquire_data(country=country)),
+            result_cache.digest(getdata.acquire_data(country=country, date_ini='2020-05-21', date_end=date_end))]
+
+
+@result_cache.cached(inputs=data_inputs)
+def main(date_end='2020-06-13', p=None, doc=None, country='United States'):
+    result = compute(date_end=date_end, p=p, country=country)
+    render(result, doc=doc)
+    return result
+
+
 # Sample execution:
 if __name__ == "__main__":
     n_kt_test = 30
@@ -207,4 +386,5 @@ if __name__ == "__main__":
     main()
 
     #  Show graphs:
+    import matplotlib.pyplot as plt
     plt.show()
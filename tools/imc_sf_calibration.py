@@ -0,0 +1,124 @@
+########################################################################################################################
+# Calibration of the p vector of the IMC-SF model, minimizing the forecast error over the comparison ("future") data
+# that imc_sf.main plots against the forecast.
+#
+# Written by Rian Koja to publish in a GitHub repository with specified license.
+########################################################################################################################
+
+# Standard imports:
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Local imports:
+from tools import imc_sf, lazy_import
+
+# scipy.optimize is only needed by the Nelder-Mead runs:
+optimize = lazy_import('scipy.optimize')
+
+
+# Data used by every objective evaluation in a process, set once per worker by init_worker:
+shared = {}
+
+
+def init_worker(history, forecast_index, observed, days, metric, bounds):
+    shared.update(history=history, forecast_index=forecast_index, observed=observed, days=days, metric=metric,
+                  bounds=bounds)
+
+
+# Forecast error of each row of the (M, 3) array p_array against the observed new cases:
+def forecast_errors(p_array):
+    forecast = imc_sf.ims_sf_forecast_batch(shared['history'], p_array, shared['days'])
+    residual = forecast['new_cases'][:, shared['forecast_index']] - shared['observed']
+    if shared['metric'] == 'mae':
+        return np.nanmean(np.abs(residual), axis=1)
+    return np.sqrt(np.nanmean(residual ** 2, axis=1))
+
+
+# Run a Nelder-Mead search from x0, keeping p inside the bounds by clipping:
+def nelder_mead_run(x0):
+    lower, upper = shared['bounds']
+    result = optimize.minimize(lambda x: forecast_errors(np.clip(x, lower, upper)[np.newaxis, :])[0], x0,
+                               method='Nelder-Mead', options={'xatol': 1e-4, 'fatol': 1e-3, 'maxfev': 2000})
+    return np.clip(result.x, lower, upper), result.fun, result.nfev
+
+
+# Build the objective data the same way imc_sf.main does: the history is forecast up to date_end and compared with the
+# data starting on date_comp_ini, of which the first seven days only serve to make the moving average contiguous:
+def objective_data(date_end='2020-06-13', date_comp_ini='2020-05-21', country='United States'):
+    data_test = imc_sf.RefData(country=country)
+    data_comp = imc_sf.RefData(date_ini=date_comp_ini, date_end=date_end, country=country)
+    data_comp.df = data_comp.df.drop(data_comp.df.index[0:7])
+
+    days = data_test.days_until(date_end)
+    # Position of each comparison date in the forecast, keeping only the dates the forecast covers:
+    forecast_index = ((data_comp.df['date'] - data_test.df.iloc[-1]['date']) / np.timedelta64(1, 'D')).values - 1
+    forecast_index = forecast_index.astype(int)
+    valid = (forecast_index >= 0) & (forecast_index < days)
+    observed = data_comp.df['new_cases'].values[valid].astype(np.float64)
+    # Only the last week of history is used by the forecast, so only that goes to the workers:
+    history = data_test.df[['date', 'new_cases', 'new_cases_7ra', 'g', 's']].iloc[-8:]
+    return history, forecast_index[valid], observed, days
+
+
+# Evaluate the candidates in chunks spread over the process pool:
+def evaluate(pool, candidates, chunk_size):
+    chunks = [candidates[ii:ii + chunk_size] for ii in range(0, len(candidates), chunk_size)]
+    if pool is None:
+        return np.concatenate([forecast_errors(chunk) for chunk in chunks])
+    return np.concatenate(list(pool.map(forecast_errors, chunks)))
+
+
+# Search the p vector of 'country' with a 'grid', 'random' or 'nelder-mead' method. Nelder-Mead runs start from the best
+# points of a random scan and run in parallel. 'processes' is the size of the pool (None uses every core, 0 runs in this
+# process). Returns a dictionary with the best p, its error and the evaluation statistics:
+def calibrate(method='nelder-mead', date_end='2020-06-13', country='United States', bounds=((0, 0, 0), (1, 1, 1)),
+              metric='rmse', n_grid=11, n_samples=4096, n_starts=4, processes=None, chunk_size=512, seed=0):
+    time_ini = time.perf_counter()
+    lower, upper = np.asarray(bounds[0], dtype=np.float64), np.asarray(bounds[1], dtype=np.float64)
+    history, forecast_index, observed, days = objective_data(date_end=date_end, country=country)
+    init_args = (history, forecast_index, observed, days, metric, (lower, upper))
+    rng = np.random.default_rng(seed)
+
+    if processes == 0:
+        init_worker(*init_args)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=init_args)
+
+    try:
+        if method == 'grid':
+            axes = [np.linspace(lower[ii], upper[ii], n_grid) for ii in range(3)]
+            candidates = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+        elif method in ['random', 'nelder-mead']:
+            candidates = lower + (upper - lower) * rng.random((n_samples, 3))
+        else:
+            raise ValueError("Unknown calibration method: " + str(method))
+        errors = evaluate(pool, candidates, chunk_size)
+        n_evaluations = len(candidates)
+        best = int(np.nanargmin(errors))
+        p_best, error_best = candidates[best], errors[best]
+
+        if method == 'nelder-mead':
+            starts = candidates[np.argsort(errors)[:n_starts]]
+            runs = map(nelder_mead_run, starts) if pool is None else pool.map(nelder_mead_run, starts)
+            for p_run, error_run, n_run in runs:
+                n_evaluations += n_run
+                if error_run < error_best:
+                    p_best, error_best = p_run, error_run
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    wall_time = time.perf_counter() - time_ini
+    return {'p': p_best.tolist(), 'error': float(error_best), 'metric': metric, 'method': method,
+            'evaluations': n_evaluations, 'wall_time': wall_time, 'evaluations_per_second': n_evaluations / wall_time}
+
+
+# Sample execution:
+if __name__ == "__main__":
+    for sample_method in ['grid', 'random', 'nelder-mead']:
+        sample_result = calibrate(method=sample_method)
+        print("Calibrated p = {} with {} = {:.2f}: {} evaluations in {:.2f} s ({:.0f} evaluations/s)".format(
+            np.round(sample_result['p'], 4).tolist(), sample_result['metric'], sample_result['error'],
+            sample_result['evaluations'], sample_result['wall_time'], sample_result['evaluations_per_second']))
@@ -7,61 +7,76 @@
 # Modified by Leonardo S. Cassara for publishing in github repository.
 # Modified by Rian Koja for usage in this project.
 
+from collections import namedtuple
 import numpy as np
-import matplotlib.pyplot as plt
 
 import tools.mfdfa_ss_m1 as mfdfa1
 import tools.mfdfa_ss_m2 as mfdfa2
 import tools.mfdfa_ss_m3 as mfdfa3
+from tools import result_cache
 
 
-def main(dx):
+# Results of the analysis, as computed by compute() and drawn by render(). 'stats' is the dictionary returned by main():
+MfdfaResult = namedtuple('MfdfaResult', ['time_measure', 'mean_data_measure', 'scales', 'b_scale', 'b_dm', 'bs_index',
+                                         'h_major', 'h_minor', 'data_measure', 'q', 'stats'])
+
+
+# Characteristics of the singularity spectrum, added to the statistics returned by mfdfa_ss_m2.get_mss_by_upscaling():
+def add_characteristics(stats):
+    stats['delta_alpha'] = stats['LH_max'] - stats['LH_min']
+    index_max = np.argmax(stats['f'])
+    stats['alpha_zero'] = stats['LH'][index_max][0]
+    stats['a_alpha'] = (stats['alpha_zero'] - stats['LH_min'])/(stats['LH_max'] - stats['alpha_zero'])
+    return stats
+
+
+# The keyword arguments select the segmentation of the data (scales, overlap, both_ends and segmentation, see
+# mfdfa_ss_core.get_upscaling_windows), which is the same for both analyses:
+def compute(dx, **segmentation):
     # Computing
     # Modified first-order DFA
-    [time_measure, mean_data_measure, scales] = mfdfa1.get_hurst_by_upscaling(dx)
+    [time_measure, mean_data_measure, scales] = mfdfa1.get_hurst_by_upscaling(dx, **segmentation)
 
     [b_scale, b_dm, bs_index, h_major, h_minor] = mfdfa3.get_scaling_exponents(time_measure, mean_data_measure)
 
     # Modified first-order MF-DFA
-    [_, data_measure, _, stats, q] = mfdfa2.get_mss_by_upscaling(dx, is_normalised=1)
+    [_, data_measure, _, stats, q] = mfdfa2.get_mss_by_upscaling(dx, is_normalised=1, **segmentation)
+
+    add_characteristics(stats)
+
+    return MfdfaResult(time_measure, mean_data_measure, scales, b_scale, b_dm, bs_index, h_major, h_minor, data_measure,
+                       q, stats)
+
+
+def render(result):
+    # Plotting is optional, so matplotlib is only imported here:
+    import matplotlib.pyplot as plt
+    stats = result.stats
 
     # Unnecessary plots for the purpose of the test are commented out
     # Output
     # Modified first-order DFA
     # plt.figure()
     # plt.subplot(2, 1, 1)
-    # plt.loglog(time_measure, mean_data_measure, 'ko-')
+    # plt.loglog(result.time_measure, result.mean_data_measure, 'ko-')
     # plt.xlabel(r'$\mu(t)$')
     # plt.ylabel(r'$\mu(\Delta x)$')
     # plt.grid('on', which='minor')
     # plt.title('Modified First-Order DFA of a Multifractal Noise')
 
     # plt.subplot(2, 1, 2)
-    # plt.loglog(scales, mean_data_measure, 'ko-')
-    # plt.loglog(b_scale, b_dm, 'ro')
+    # plt.loglog(result.scales, result.mean_data_measure, 'ko-')
+    # plt.loglog(result.b_scale, result.b_dm, 'ro')
     # plt.xlabel(r'$j$')
     # plt.ylabel(r'$\mu(\Delta x)$')
     # plt.grid('on', which='minor')
 
-    # Modified first-order MF-DFA
-    stats['delta_alpha'] = stats['LH_max'] - stats['LH_min']
-    print('alpha_min = %g, alpha_max = %g, dalpha = %g'
-          % (stats['LH_min'], stats['LH_max'], stats['delta_alpha']))
-    index_max = np.argmax(stats['f'])
-    stats['alpha_zero'] = stats['LH'][index_max][0]
-
-    print('alpha_zero =', stats['alpha_zero'])
-    stats['a_alpha'] = (stats['alpha_zero'] - stats['LH_min'])/(stats['LH_max'] - stats['alpha_zero'])
-    print('a_alpha =', stats['a_alpha'])
-
-    print('h_min = %g, h_max = %g, dh = %g\n' % (stats['h_min'], stats['h_max'], stats['delta_alpha']))
-
     # plt.figure()
-    # nq = np.int(len(q))
+    # nq = len(result.q)
     # leg_txt = []
     # for qi in range(1, nq + 1):
-    #     llh = plt.loglog(scales, data_measure[qi - 1, :], 'o-')
-    #     leg_txt.append(r'$\tau$' + ' = %2.1e (q = %2.1e)' % (stats['tau'][qi - 1], q[qi - 1]))
+    #     llh = plt.loglog(result.scales, result.data_measure[qi - 1, :], 'o-')
+    #     leg_txt.append(r'$\tau$' + ' = %2.1e (q = %2.1e)' % (stats['tau'][qi - 1], result.q[qi - 1]))
     # plt.xlabel(r'$j$')
     # plt.ylabel(r'$\mu(\Delta x, q)$')
     # plt.grid('on', which='minor')
@@ -70,14 +85,14 @@ def main(dx):
     # plt.tight_layout()
 
     # plt.figure()
-    # plt.plot(q, stats['tau'], 'ko-')
+    # plt.plot(result.q, stats['tau'], 'ko-')
     # plt.xlabel(r'$q$')
     # plt.ylabel(r'$\tau(q)$')
     # plt.grid('on', which='major')
     # plt.title('Statistics of Modified First-Order MF-DFA of a Multifractal Noise')
 
     # Plot singularity spectra:
-    plt.figure()
+    fig = plt.figure()
     plt.plot(stats['LH'], stats['f'], 'ko-')
     plt.xlabel(r'$\alpha$')
     plt.ylabel(r'$f(\alpha)$')
@@ -86,7 +101,20 @@ def main(dx):
               + r' $\Delta\alpha$ = %g ' % stats['delta_alpha'] + "\n" + r'$\alpha_0$ = %g ' % stats['alpha_zero'] +
               r'$A_\alpha$ = %g ' % stats['a_alpha'])
     plt.tight_layout()
+    return fig
 
+
+@result_cache.cached(depends=('tools.mfdfa_ss_m1', 'tools.mfdfa_ss_m2', 'tools.mfdfa_ss_m3', 'tools.mfdfa_ss_core'))
+def main(dx, **segmentation):
+    result = compute(dx, **segmentation)
+    stats = result.stats
+    print('alpha_min = %g, alpha_max = %g, dalpha = %g'
+          % (stats['LH_min'], stats['LH_max'], stats['delta_alpha']))
+    print('alpha_zero =', stats['alpha_zero'])
+    print('a_alpha =', stats['a_alpha'])
+    print('h_min = %g, h_max = %g, dh = %g\n' % (stats['h_min'], stats['h_max'], stats['delta_alpha']))
+
+    render(result)
     return stats
 
 
@@ -96,5 +124,5 @@ if __name__ == "__main__":
     sample_data, _ = np.random.multivariate_normal(mean, cov, size=256).T
     sample_data = sample_data.tolist()
     main(sample_data)
+    import matplotlib.pyplot as plt
     plt.show()
-
@@ -0,0 +1,152 @@
+########################################################################################################################
+# Upscaling engine shared by the unifractal (mfdfa_ss_m1) and multifractal (mfdfa_ss_m2) analyses. Both walk the same
+# scales and windows of the data and compute the same velocities and accelerations; only the reduction of the
+# per-window ranges and normalisation factors differs. Those are computed here once per input and kept in a small cache,
+# so analysing a series with both modules costs a single pass over it.
+#
+# Written by Rian Koja to publish in a GitHub repository with specified license.
+########################################################################################################################
+
+# Standard imports:
+import hashlib
+from collections import namedtuple, OrderedDict
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# Per-scale windows of an input: 'rr' and 'ss' are lists with one array of ranges and normalisation factors per scale:
+UpscalingWindows = namedtuple('UpscalingWindows', ['dx_len', 'dx_shift', 'j', 'rr', 'ss'])
+
+# Most recently used results, keyed by a hash of the data and the parameters, and the number of results kept:
+cache = OrderedDict()
+cache_size = 8
+counters = {'hits': 0, 'misses': 0}
+
+
+# Ranges and normalisation factors ("standard deviations") of the 'n' windows of the scale with half-length 'h', whose
+# data start at 'first_start' and follow each other every 'step' samples (by default '2 * h', i.e. without overlap).
+# 'cumulative' holds the prefix sums of the data, so the velocities and accelerations of all windows come from a single
+# second difference of it, instead of one convolution per window. The windows are processed 'chunk_size' samples at a
+# time to bound the memory in use, and 'dtype' sets the precision of the accelerations and ranges (the prefix sums are
+# kept in double precision):
+def get_window_ranges(cumulative, h, first_start, n, norm_type=np.inf, is_dfa=1, dtype=np.float64, chunk_size=2 ** 20,
+                      step=None):
+    if step is None:
+        step = 2 * h
+    rr = np.zeros(n, dtype=dtype)
+    ss = np.ones(n, dtype=dtype)
+    windows_per_chunk = max(1, chunk_size // step)
+
+    for k_ini in range(0, n, windows_per_chunk):
+        k_end = min(n, k_ini + windows_per_chunk)
+        start = first_start + k_ini * step
+        length = (k_end - k_ini - 1) * step + 2 * h + 1
+        # The window k has the accelerations 'r' at the scale 'j + 1' (as computed from the velocities, i.e. the moving
+        # sums of 'h' samples) in r[start_k : start_k + 2 * h + 1], where start_k = start + (k - k_ini) * step:
+        c = cumulative[start:start + length + 2 * h]
+        r = ((c[2 * h:] - c[h:-h]) - (c[h:-h] - c[:-2 * h])).astype(dtype) / 2.0
+        # Excluding the first acceleration of each one, contiguous windows form a matrix, while overlapping ones are
+        # strided views of the accelerations:
+        if step == 2 * h:
+            r_windows = r[1:].reshape(-1, 2 * h)
+        else:
+            r_windows = sliding_window_view(r[1:], 2 * h)[::step]
+
+        # Finally we compute the range ...
+        if norm_type == 0:
+            rr[k_ini:k_end] = np.max(r_windows, axis=1) - np.min(r_windows, axis=1)
+        elif np.isinf(norm_type):
+            rr[k_ini:k_end] = np.max(np.abs(r_windows), axis=1)
+        else:
+            rr[k_ini:k_end] = (np.sum(r_windows ** norm_type, axis=1) / (2 * h)) ** (1.0 / norm_type)
+        # ... and the normalisation factor ("standard deviation")
+        if is_dfa == 0:
+            dr = np.diff(r) ** 2.0
+            if step == 2 * h:
+                ss[k_ini:k_end] = np.sqrt(np.sum(dr.reshape(-1, 2 * h), axis=1) / (2 * h))
+            else:
+                ss[k_ini:k_end] = np.sqrt(np.sum(sliding_window_view(dr, 2 * h)[::step], axis=1) / (2 * h))
+
+    return rr, ss
+
+
+# Scales 'j + 1' (the half-lengths of the windows) from 1 up to about half of 'dx_len', with 'n_per_octave' scales
+# between consecutive powers of two. With one scale per octave, these are the original dyadic scales:
+def get_scales(dx_len, n_per_octave=1):
+    n_octaves = max(1, int(np.round(np.log2(max(dx_len, 1)))))
+    exponents = np.arange((n_octaves - 1) * n_per_octave + 1) / n_per_octave
+    return np.unique(np.round(2.0 ** exponents).astype(int))
+
+
+# Compute the windows of every scale of 'dx' (see get_window_ranges), or return them from the cache if the same data was
+# already analysed with the same parameters. The arrays returned are shared with the cache, so they are read-only.
+#
+# With the 'centred' segmentation, the most major scale is reserved for shifts: windows only cover the middle of the
+# data and their boundaries come from either side of it, as in the original algorithm. The 'full' segmentation lets
+# windows cover the whole series instead. Either way any data length is accepted: 'scales' (by default get_scales()) may
+# be any increasing set of half-lengths, and the scales without room for a single window are left out. Windows start
+# every '2 * scale * (1 - overlap)' samples, and with 'both_ends' the segmentation is repeated from the end of the
+# series, so the remainder that does not fill a window is not discarded:
+def get_upscaling_windows(dx, norm_type=np.inf, is_dfa=1, dtype=np.float64, chunk_size=2 ** 20, scales=None,
+                          overlap=0.0, both_ends=False, segmentation='centred'):
+    dx = np.ascontiguousarray(dx, dtype=np.float64)
+    # We have to reserve the most major scale for shifts, so we divide the data
+    # length by two. (As a result, the time measure starts from 2.0, not from
+    # 1.0, see mfdfa_ss_m1 and mfdfa_ss_m2.)
+    dx_len = int(len(dx) / 2)
+
+    dx_shift = int(dx_len / 2)
+
+    if scales is None:
+        scales = get_scales(dx_len)
+    scales = np.asarray(scales, dtype=int)
+
+    key = (hashlib.sha1(dx.view(np.uint8)).hexdigest(), len(dx), float(norm_type), int(is_dfa), np.dtype(dtype).str,
+           tuple(scales.tolist()), float(overlap), bool(both_ends), segmentation)
+    if key in cache:
+        counters['hits'] += 1
+        cache.move_to_end(key)
+        return cache[key]
+    counters['misses'] += 1
+
+    # The accelerations are second differences of the prefix sums, to which the mean of the data does not contribute,
+    # so it is removed to keep the prefix sums small:
+    cumulative = np.concatenate(([0.0], np.cumsum(dx - np.mean(dx))))
+
+    j, rr_scales, ss_scales = [], [], []
+    for h in scales:
+        # At the scale 'h = j + 1' windows have '2 * h' elements of the data 'dx', and each one comes with 'h' more
+        # elements from the left and right boundaries. We find the first and last possible starts of a window ...
+        if segmentation == 'centred':
+            lowest, highest = dx_shift - h, dx_shift + dx_len - 3 * h
+        elif segmentation == 'full':
+            lowest, highest = 0, len(dx) - 4 * h
+        else:
+            raise ValueError("Unknown segmentation: " + str(segmentation))
+        if h < 1 or lowest < 0 or highest < lowest:
+            continue
+        # ... and lay the windows from the first one forward and, optionally, from the last one backward:
+        step = max(1, int(np.round(2 * h * (1.0 - overlap))))
+        n = (highest - lowest) // step + 1
+        first_starts = [lowest, highest - (n - 1) * step] if both_ends else [lowest]
+
+        ranges = [get_window_ranges(cumulative, h, first_start, n, norm_type=norm_type, is_dfa=is_dfa, dtype=dtype,
+                                    chunk_size=chunk_size, step=step) for first_start in first_starts]
+        rr = np.concatenate([rr_part for rr_part, _ in ranges])
+        ss = np.concatenate([ss_part for _, ss_part in ranges])
+        rr.flags.writeable = False
+        ss.flags.writeable = False
+        j.append(h - 1)
+        rr_scales.append(rr)
+        ss_scales.append(ss)
+
+    windows = UpscalingWindows(dx_len, dx_shift, np.array(j, dtype=int), rr_scales, ss_scales)
+    cache[key] = windows
+    while len(cache) > cache_size:
+        cache.popitem(last=False)
+    return windows
+
+
+def clear_cache():
+    cache.clear()
+    counters.update(hits=0, misses=0)
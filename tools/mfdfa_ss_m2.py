@@ -5,11 +5,13 @@
 # corresponding unifractal analysis technique described in [1]. It computes the Lipschitz-Holder multifractal
 # singularity spectrum, as well as the minimum and maximum generalised Hurst exponents [2, 3].
 #
-# At the input, 'dx' is a time series of increments of the physical observable 'x(t)', of the length equal to an
-# integer power of two greater than two (i.e. 4, 8, 16, 32, etc.), 'normType' is any real greater than or
+# At the input, 'dx' is a time series of increments of the physical observable 'x(t)', preferably of the length equal to
+# an integer power of two greater than two (i.e. 4, 8, 16, 32, etc.), 'normType' is any real greater than or
 # equal to one specifying the p-norm, 'is_dfa' is a boolean value prescribing to use either the DFA-based algorithm or
 # the standard Hurst (a.k.a. R/S) analysis, 'isNormalised' is a boolean value prescribing either to normalise the
-# intermediate range-to-deviation (R/S) expression or to proceed computing without normalisation.
+# intermediate range-to-deviation (R/S) expression or to proceed computing without normalisation. The optional 'scales',
+# 'overlap', 'both_ends' and 'segmentation' select how data of any length is split into windows, as described in
+# mfdfa_ss_core.get_upscaling_windows().
 #
 # At the output, 'timeMeasure' is the time measure of the data's support at different scales, 'dataMeasure' is
 # the data measure at different scales computed for each value of the variable q-norm, 'scales' is the scales at which
@@ -30,80 +32,55 @@
 
 import numpy as np
 
+from tools import mfdfa_ss_core
 
-def get_mss_by_upscaling(dx, norm_type=np.inf, is_dfa=1, is_normalised=1):
-    # Some initialisation
-    aux_eps = np.finfo(float).eps
 
-    # We prepare an array of values of the variable q-norm
+# Values of the variable q-norm, as a column vector:
+def get_q():
     aux = [-16.0, -8.0, -4.0, -2.0, -1.0, -0.5, -0.0001, 0.0, 0.0001, 0.5, 0.9999, 1.0, 1.0001, 2.0, 4.0, 8.0, 16.0,
            32.0]
-    nq = len(aux)
-
-    q = np.zeros((nq, 1))
+    q = np.zeros((len(aux), 1))
     q[:, 1 - 1] = aux
+    return q
 
-    dx_len = len(dx)
-
-    # We have to reserve the most major scale for shifts, so we divide the data
-    # length by two. (As a result, the time measure starts from 2.0, not from
-    # 1.0, see below.)
-    dx_len = np.int(dx_len / 2)
-
-    dx_shift = np.int(dx_len / 2)
 
-    n_scales = np.int(np.round(np.log2(
-        dx_len)))  # Number of scales involved. P.ss. We use 'round()' to prevent possible malcomputing of the logarithms
-    j = 2 ** (np.arange(1, n_scales + 1) - 1) - 1
-
-    data_measure = np.zeros((nq, n_scales))
+# Data measures in the q-norms 'q' at each scale, from the lists of the windows' ranges 'rr' and normalisation factors
+# 'ss' of every scale:
+def get_data_measures(rr_scales, ss_scales, q, is_normalised=1, chunk_size=2 ** 20):
+    aux_eps = np.finfo(float).eps
+    data_measure = np.zeros((len(q), len(rr_scales)))
 
     # Computing the data measures in different q-norms
-    for ji in range(1, n_scales + 1):
-        # At the scale 'j(ji)' we deal with '2 * (j(ji) + 1)' elements of the data 'dx'
-        dx_k_len = 2 * (j[ji - 1] + 1)
-        n = np.int(dx_len / dx_k_len)
-
-        dx_left_shift = np.int(dx_k_len / 2)
-        dx_right_shift = np.int(dx_k_len / 2)
-
-        rr = np.zeros(n)
-        ss = np.ones(n)
-        for k in range(1, n + 1):
-            # We get a portion of the data of the length '2*(j(ji)+1)' plus the data from the left and right boundaries
-            dx_k_with_shifts = dx[(k - 1) * dx_k_len + 1 + dx_shift - dx_left_shift - 1:
-                                  k * dx_k_len + dx_shift + dx_right_shift]
-
-            # Then we perform free upscaling and, using the above-selected data (provided at the scale j = 0),
-            # compute the velocities at the scale 'j(ji)'
-            j_dx = np.convolve(dx_k_with_shifts, np.ones(dx_right_shift), 'valid')
-
-            # Then we compute the accelerations at the scale 'j(ji) + 1'
-            r = (j_dx[1 + dx_right_shift - 1:] - j_dx[1 - 1: -dx_right_shift]) / 2.0
-
-            # Finally we compute the range ...
-            if norm_type == 0:
-                rr[k - 1] = np.max(r[2 - 1:]) - np.min(r[2 - 1:])
-            elif np.isinf(norm_type):
-                rr[k - 1] = np.max(np.abs(r[2 - 1:]))
-            else:
-                rr[k - 1] = (np.sum(r[2 - 1:] ** norm_type) / len(r[2 - 1:])) ** (1.0 / norm_type)
-            # ... and the normalisation factor ("standard deviation")
-            if is_dfa == 0:
-                ss[k - 1] = np.sqrt(np.sum(np.abs(np.diff(r)) ** 2.0) / (len(r) - 1))
-
+    for ji in range(1, len(rr_scales) + 1):
+        # The measures are raised to powers up to |q| = 32, so they are always computed in double precision:
+        rr = np.asarray(rr_scales[ji - 1], dtype=np.float64)
+        ss = np.asarray(ss_scales[ji - 1], dtype=np.float64)
         if is_normalised == 1:  # Then we either normalise the rr / ss values, treating them as probabilities ...
             p = np.divide(rr, ss) / np.sum(np.divide(rr, ss))
         else:  # ... or leave them unnormalised ...
             p = np.divide(rr, ss)
-        # ... and compute the measures in the q-norms
-        for k in range(1, n + 1):
-            # This 'if' is needed to prevent measure blow-ups with
-            # negative values of 'q' when the probability is close to zero
-            if p[k - 1] < 1000.0 * aux_eps:
-                continue
+        # ... and compute the measures in the q-norms, all windows at once. Probabilities close to zero are left out,
+        # to prevent measure blow-ups with negative values of 'q'
+        p = p[p >= 1000.0 * aux_eps]
+        for k_ini in range(0, len(p), chunk_size):
+            data_measure[:, ji - 1] += np.sum(np.power(p[np.newaxis, k_ini:k_ini + chunk_size], q), axis=1)
 
-            data_measure[:, ji - 1] = data_measure[:, ji - 1] + np.power(p[k - 1], q[:, 1 - 1])
+    return data_measure
+
+
+def get_mss_by_upscaling(dx, norm_type=np.inf, is_dfa=1, is_normalised=1, dtype=np.float64, chunk_size=2 ** 20,
+                         scales=None, overlap=0.0, both_ends=False, segmentation='centred'):
+    # We prepare an array of values of the variable q-norm
+    q = get_q()
+
+    # The ranges and normalisation factors of the windows of every scale are shared with the unifractal analysis:
+    windows = mfdfa_ss_core.get_upscaling_windows(dx, norm_type=norm_type, is_dfa=is_dfa, dtype=dtype,
+                                                  chunk_size=chunk_size, scales=scales, overlap=overlap,
+                                                  both_ends=both_ends, segmentation=segmentation)
+    dx_len = windows.dx_len
+    j = windows.j
+
+    data_measure = get_data_measures(windows.rr, windows.ss, q, is_normalised=is_normalised, chunk_size=chunk_size)
 
     # We pass from the scales ('j') to the time measure; the time measure at the scale j(n_scales) (the most major one)
     # is assumed to be 2.0, while it is growing when the scale is tending to j(1) (the most minor one).
@@ -113,6 +90,16 @@ def get_mss_by_upscaling(dx, norm_type=np.inf, is_dfa=1, is_normalised=1):
 
     scales = j + 1
 
+    stats = get_spectrum(time_measure, data_measure, q)
+
+    return [time_measure, data_measure, scales, stats, q]
+
+
+# Multifractal statistics (see above) of the data measures 'data_measure' in the q-norms 'q' at the time measures
+# 'time_measure':
+def get_spectrum(time_measure, data_measure, q):
+    nq = len(q)
+
     # Determining the exponents 'tau' from 'data_measure(q, time_measure) ~ time_measure ^ tau(q)'
     tau = np.zeros((nq, 1))
     log10tm = np.log10(time_measure)
@@ -151,4 +138,4 @@ def get_mss_by_upscaling(dx, norm_type=np.inf, is_dfa=1, is_normalised=1):
              'h_min': h_min,
              'h_max': h_max}
 
-    return [time_measure, data_measure, scales, stats, q]
+    return stats
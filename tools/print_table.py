@@ -8,9 +8,13 @@
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import six
 
+from tools import lazy_import
+
+# matplotlib is only loaded when a table is first drawn:
+plt = lazy_import('matplotlib.pyplot')
+
 
 def render_mpl_table(data, col_width=3.0, row_height=0.625, font_size=14,
                      header_color='#40466e', row_colors=None, edge_color='w',
@@ -0,0 +1,176 @@
+########################################################################################################################
+# Content-addressed cache of analysis results and of the figures they draw, kept on disk so a report can be regenerated
+# recomputing only what changed. Entries are keyed by the function, its arguments (data arguments by a hash of their
+# contents), the hash of any data the function reads by itself, and a hash of the source code it depends on.
+#
+# Written by Rian Koja to publish in a GitHub repository with specified license.
+########################################################################################################################
+
+# Standard imports:
+import functools
+import hashlib
+import importlib
+import inspect
+import io
+import json
+import os
+import pickle
+import sys
+import numpy as np
+
+from tools import lazy_import
+
+# pandas is only loaded when first used. matplotlib is never loaded here unless a cached function or a cache hit draws a
+# figure, so the compute modules that use this cache can be imported without it:
+pd = lazy_import('pandas')
+
+
+cache_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'mount', 'result_cache')
+# Set to False to always recompute:
+enabled = True
+counters = {'hits': 0, 'misses': 0}
+# Arrays are hashed in blocks of about this many bytes, so a memory-mapped dataset is never read into memory at once:
+block_bytes = 2 ** 24
+
+
+def array_digest(array):
+    sha = hashlib.sha1('{}{}'.format(array.dtype.str, array.shape).encode())
+    if array.ndim == 0:
+        array = array.reshape(1)
+    rows = max(1, block_bytes // max(1, array[:1].nbytes))
+    for first in range(0, len(array), rows):
+        sha.update(memoryview(np.ascontiguousarray(array[first:first + rows]).reshape(-1).view(np.uint8)))
+    return sha.hexdigest()
+
+
+# Hash of the contents of an argument: numeric sequences and frames by their values, anything else by its pickle:
+def digest(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return repr(value)
+    if isinstance(value, dict):
+        return {str(key): digest(value[key]) for key in sorted(value, key=str)}
+    if type(value).__name__ == 'DataFrame':
+        hashes = pd.util.hash_pandas_object(value, index=True).values
+        return 'frame:' + hashlib.sha1(repr(list(value.columns)).encode() + hashes.tobytes()).hexdigest()
+    try:
+        array = np.asarray(value)
+    except Exception:
+        array = None
+    if array is not None and array.dtype.kind in 'biufcmM':
+        return 'array:' + array_digest(array)
+    return 'pickle:' + hashlib.sha1(pickle.dumps(value)).hexdigest()
+
+
+# Hash of the source of the given modules (and of this one, which defines how entries are stored):
+@functools.lru_cache(maxsize=None)
+def code_version(module_names):
+    sha = hashlib.sha1()
+    for name in sorted(set(module_names) | {__name__}):
+        with open(importlib.import_module(name).__file__, 'rb') as source_file:
+            sha.update(source_file.read())
+    return sha.hexdigest()
+
+
+def entry_filename(key):
+    return os.path.join(cache_dir, key[:2], key + '.pkl')
+
+
+def load(key):
+    try:
+        with open(entry_filename(key), 'rb') as entry_file:
+            return pickle.load(entry_file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+# Write under a temporary name and rename it in place, so concurrent readers never see half-written entries:
+def store(key, entry):
+    file_name = entry_filename(key)
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    temporary_name = file_name + '.{}.tmp'.format(os.getpid())
+    with open(temporary_name, 'wb') as entry_file:
+        pickle.dump(entry, entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary_name, file_name)
+
+
+# PNG bytes and resolution of a figure:
+def encode_figure(fig):
+    memfile = io.BytesIO()
+    fig.savefig(memfile, format='png', dpi=fig.dpi)
+    return memfile.getvalue(), fig.dpi
+
+
+# A new figure showing a cached PNG pixel for pixel. The PNG is kept in its 'cached_png' attribute, so a report can use
+# it as it is instead of rendering the figure again:
+def restore_figure(png, dpi):
+    import matplotlib.pyplot as plt
+    image = plt.imread(io.BytesIO(png))
+    fig = plt.figure(figsize=(image.shape[1] / dpi, image.shape[0] / dpi), dpi=dpi)
+    fig.figimage(image, resize=False)
+    fig.cached_png = png
+    return fig
+
+
+# Whether a value is a stream (a generator or other iterator), which can only be read once and so is never cached:
+def is_stream(value):
+    return hasattr(value, '__iter__') and not hasattr(value, '__len__')
+
+
+# Decorator caching the result of a function and the figures it draws. 'depends' names the modules, besides the one of
+# the function, whose code the result depends on. 'inputs', called with the same arguments as the function, returns
+# the hash (see digest) of any data it reads by itself. Arguments named in 'ignore' are left out of the key, and a 'doc'
+# argument (a createdocument.ReportDocument) is not given to the function: the figures drawn, or restored from the
+# cache, are added to it instead. Calls with a stream among their arguments (see is_stream) are not cached:
+def cached(depends=(), inputs=None, ignore=()):
+    def decorator(function):
+        signature = inspect.signature(function)
+        module_names = (function.__module__,) + tuple(depends)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            if any(is_stream(value) for value in bound.arguments.values()):
+                return function(*args, **kwargs)
+            doc = bound.arguments.get('doc')
+            if doc is not None:
+                bound.arguments['doc'] = None
+            arguments = {name: digest(value) for name, value in bound.arguments.items()
+                         if name not in ignore and name != 'doc'}
+            key_data = {'function': function.__module__ + '.' + function.__qualname__,
+                        'code': code_version(module_names), 'arguments': arguments,
+                        'inputs': None if inputs is None else inputs(*args, **kwargs)}
+            key = hashlib.sha1(json.dumps(key_data, sort_keys=True).encode()).hexdigest()
+
+            entry = load(key)
+            if entry is not None:
+                counters['hits'] += 1
+                figures = [restore_figure(png, dpi) for png, dpi in entry['figures']]
+                result = entry['result']
+            else:
+                counters['misses'] += 1
+                # Without pyplot loaded there are no figures yet, and the function can only draw by loading it:
+                before = set(sys.modules['matplotlib.pyplot'].get_fignums()) if 'matplotlib.pyplot' in sys.modules \
+                    else set()
+                result = function(*bound.args, **bound.kwargs)
+                figures = []
+                if 'matplotlib.pyplot' in sys.modules:
+                    import matplotlib.pyplot as plt
+                    figures = [plt.figure(number) for number in plt.get_fignums() if number not in before]
+                store(key, {'result': result, 'figures': [encode_figure(fig) for fig in figures]})
+            if doc is not None:
+                for fig in figures:
+                    doc.add_fig(fig=fig)
+            return result
+        return wrapper
+    return decorator
+
+
+# Remove every entry of the cache:
+def clear():
+    for directory, _, file_names in os.walk(cache_dir):
+        for file_name in file_names:
+            if file_name.endswith('.pkl'):
+                os.remove(os.path.join(directory, file_name))
@@ -0,0 +1,126 @@
+########################################################################################################################
+# Machine-readable store of the numeric results of the analyses, written alongside the Word report. Each analysis has a
+# schema and its own append-only JSON lines file, so the results of many runs can be queried (for instance with
+# read_results) without parsing reports or running anything again. Records are buffered and written in batches.
+#
+# Written by Rian Koja to publish in a GitHub repository with specified license.
+########################################################################################################################
+
+# Standard imports:
+import json
+import os
+import time
+import uuid
+import numpy as np
+
+from tools import lazy_import
+
+# pandas is only loaded when results are read back:
+pd = lazy_import('pandas')
+
+
+results_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'mount', 'results')
+
+# Fields of the records of each analysis and their types. Every record also has the fields in common_fields:
+schemas = {
+    'histogram': {'counts': 'int_list', 'edges': 'float_list'},
+    'cullen_frey': {'skewness_square': 'float', 'kurtosis': 'float'},
+    'gaussian_fit': {'loc': 'float', 'scale': 'float'},
+    'spectral': {'alpha': 'float', 'beta_theoretical': 'float'},
+    'mfdfa': {'delta_alpha': 'float', 'alpha_zero': 'float', 'a_alpha': 'float'},
+    'imc_sf_forecast': {'p': 'float_list', 'date': 'str_list', 'new_cases': 'float_list', 'n_s_min': 'float_list',
+                        'n_s_max': 'float_list'},
+    # One record per candidate family, ranked from the best fit (rank 0); failed fits have no parameters or scores:
+    'distribution_fit': {'rank': 'int', 'family': 'str', 'params': 'float_list', 'aic': 'float', 'bic': 'float',
+                         'ks_stat': 'float'},
+    # Analyses that failed, with the exception raised:
+    'error': {'error': 'str'},
+}
+common_fields = {'run_id': 'str', 'timestamp': 'str', 'analysis': 'str', 'country': 'str', 'date_ini': 'str',
+                 'date_end': 'str'}
+
+
+# NaN and infinities are not valid JSON, so they are written as null:
+def json_float(value):
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+# Conversion of the values to each type, so numpy scalars, arrays and Series are written as plain JSON:
+converters = {
+    'float': json_float,
+    'int': int,
+    'str': str,
+    'float_list': lambda value: [json_float(item) for item in np.asarray(value, dtype=np.float64).ravel()],
+    'int_list': lambda value: [int(item) for item in np.asarray(value).ravel()],
+    'str_list': lambda value: [str(item) for item in value],
+}
+
+
+# Check 'values' against the schema of 'analysis' and convert them to its types. Raises ValueError on unknown analyses
+# or on missing or unexpected fields:
+def validate(analysis, values):
+    if analysis not in schemas:
+        raise ValueError("Unknown analysis: " + str(analysis))
+    schema = dict(common_fields, **schemas[analysis])
+    missing = set(schema) - set(values)
+    unexpected = set(values) - set(schema)
+    if missing or unexpected:
+        raise ValueError("Record of {} with missing fields {} and unexpected fields {}".format(
+            analysis, sorted(missing), sorted(unexpected)))
+    return {field: None if values[field] is None else converters[field_type](values[field])
+            for field, field_type in schema.items()}
+
+
+def results_filename(analysis, directory=None):
+    return os.path.join(directory or results_dir, analysis + '.jsonl')
+
+
+# Writes the records of one run. 'context' holds the common fields other than run_id, timestamp and analysis (country,
+# date_ini, date_end), which can also be overridden per record. Records are kept until 'batch_size' of them are
+# buffered, then appended to their files with a single write each; flush() or leaving a with block writes the rest:
+class ResultsSink:
+    def __init__(self, directory=None, run_id=None, context=None, batch_size=100):
+        self.directory = directory or results_dir
+        self.run_id = run_id or uuid.uuid4().hex
+        self.context = {'country': None, 'date_ini': None, 'date_end': None}
+        self.context.update(context or {})
+        self.batch_size = batch_size
+        self.buffer = {}
+        self.n_buffered = 0
+
+    def write(self, analysis, **values):
+        record = dict(self.context, run_id=self.run_id, timestamp=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                      analysis=analysis)
+        record.update(values)
+        self.buffer.setdefault(analysis, []).append(json.dumps(validate(analysis, record)))
+        self.n_buffered += 1
+        if self.n_buffered >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.n_buffered == 0:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for analysis, lines in self.buffer.items():
+            with open(results_filename(analysis, self.directory), 'a') as results_file:
+                results_file.write('\n'.join(lines) + '\n')
+        self.buffer = {}
+        self.n_buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+# Records of 'analysis' as a DataFrame, optionally only those of the given runs:
+def read_results(analysis, directory=None, run_ids=None):
+    file_name = results_filename(analysis, directory)
+    if not os.path.isfile(file_name):
+        return pd.DataFrame(columns=list(common_fields) + list(schemas[analysis]))
+    df = pd.read_json(file_name, lines=True, dtype=False)
+    if run_ids is not None:
+        df = df[df['run_id'].isin(run_ids)]
+    return df
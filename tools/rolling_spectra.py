@@ -0,0 +1,101 @@
+########################################################################################################################
+# Rolling (sliding-window) versions of the singularity spectrum characteristics of mfdfa_ss and of the spectral indices
+# of specplus, for monitoring a series that grows one observation at a time.
+#
+# The multifractal analysis is kept up to date incrementally: windows of each scale are laid on a grid fixed to the
+# stream, so a new observation completes at most one window per scale. Its range and normalisation factor are computed
+# from the prefix sums of its own 4 * scale samples and stored, and windows leaving the rolling window are dropped,
+# which amortizes to O(1) work per scale for each observation. The q-norm measures are then reduced from the stored
+# window aggregates; running sums of their powers are not kept, since with |q| up to 32 subtracting the windows that
+# leave would cancel catastrophically.
+#
+# Written by Rian Koja to publish in a GitHub repository with specified license.
+########################################################################################################################
+
+# Standard imports:
+from collections import deque
+import numpy as np
+
+# Local imports:
+from tools import mfdfa_ss, mfdfa_ss_core, specplus
+import tools.mfdfa_ss_m2 as mfdfa2
+
+
+class RollingSpectrum:
+    # 'window' is the number of most recent observations analysed, and 'scales' the half-lengths of the windows of the
+    # multifractal analysis (by default, the dyadic scales that always fit in the rolling window):
+    def __init__(self, window=128, scales=None, norm_type=np.inf, is_dfa=1):
+        if scales is None:
+            scales = mfdfa_ss_core.get_scales(window // 2)
+        scales = np.asarray(scales, dtype=int)
+        # The latest window of a scale h ends up to 2 * h - 1 observations ago and spans 4 * h of them, so only scales
+        # for which one always fits in the rolling window are kept:
+        self.scales = scales[(scales >= 1) & (6 * scales - 1 <= window)]
+        if len(self.scales) < 2:
+            raise ValueError("A rolling window of {} observations is too short for the scales".format(window))
+        self.window = window
+        self.norm_type = norm_type
+        self.is_dfa = is_dfa
+        self.q = mfdfa2.get_q()
+        # Observations are written twice in a buffer of twice the window, so the latest ones are always contiguous:
+        self.buffer = np.zeros(2 * window)
+        self.count = 0
+        # Per scale, the end, range and normalisation factor of the windows inside the rolling window:
+        self.windows = [deque() for _ in self.scales]
+
+    def append(self, value):
+        position = self.count % self.window
+        self.buffer[position] = self.buffer[position + self.window] = value
+        self.count += 1
+        for idx, h in enumerate(self.scales):
+            windows = self.windows[idx]
+            # A window of the scale h starts every 2 * h observations, and completes 4 * h observations later:
+            if self.count % (2 * h) == 0 and self.count >= 4 * h:
+                data = self.latest(4 * h)
+                cumulative = np.concatenate(([0.0], np.cumsum(data - np.mean(data))))
+                rr, ss = mfdfa_ss_core.get_window_ranges(cumulative, h, 0, 1, norm_type=self.norm_type,
+                                                         is_dfa=self.is_dfa)
+                windows.append((self.count, rr[0], ss[0]))
+            while windows and windows[0][0] - 4 * h < self.count - self.window:
+                windows.popleft()
+
+    # The latest 'n' observations, oldest first:
+    def latest(self, n):
+        end = (self.count - 1) % self.window + 1 + self.window
+        return self.buffer[end - n:end]
+
+    def ready(self):
+        return self.count >= self.window
+
+    # Singularity spectrum statistics of the rolling window, as computed by mfdfa_ss.compute(). With 'spectral' the
+    # specplus alpha and beta of the window are added, which are computed afresh:
+    def stats(self, spectral=True):
+        rr_scales = [np.array([window[1] for window in windows]) for windows in self.windows]
+        ss_scales = [np.array([window[2] for window in windows]) for windows in self.windows]
+        data_measure = mfdfa2.get_data_measures(rr_scales, ss_scales, self.q)
+        time_measure = 2.0 * (self.window // 2) / (2 * self.scales)
+        stats = mfdfa_ss.add_characteristics(mfdfa2.get_spectrum(time_measure, data_measure, self.q))
+
+        record = {'index': self.count - 1, 'LH_min': stats['LH_min'], 'LH_max': stats['LH_max'],
+                  'delta_alpha': stats['delta_alpha'], 'alpha_zero': stats['alpha_zero'], 'a_alpha': stats['a_alpha']}
+        if spectral:
+            result = specplus.compute(self.latest(self.window).copy())
+            record.update(alpha=result.alpha, beta=result.beta, beta_theoretical=result.beta_theoretical)
+        return record
+
+
+# Consume a stream of observations, yielding the statistics of the rolling window (see RollingSpectrum.stats) every
+# 'every' observations once the window is full. 'index' in each record is the position of the latest observation:
+def rolling_spectra(observations, window=128, every=1, scales=None, spectral=True):
+    rolling = RollingSpectrum(window=window, scales=scales)
+    for value in observations:
+        rolling.append(value)
+        if rolling.ready() and (rolling.count - rolling.window) % every == 0:
+            yield rolling.stats(spectral=spectral)
+
+
+# Sample execution:
+if __name__ == "__main__":
+    sample_data = np.random.default_rng(0).normal(size=1024)
+    for sample_record in rolling_spectra(sample_data, window=256, every=128):
+        print(sample_record)
@@ -11,65 +11,185 @@
 # ------------------------------------------------------------------------
 # Specplus.pyplot
 # ------------------------------------------------------------------------
-import matplotlib.pyplot as plt
-import matplotlib.mlab as mlab
-from scipy import stats, optimize
+from collections import namedtuple
+import functools
+from numpy.lib.stride_tricks import sliding_window_view
 import numpy as np
 import math
 
+from tools import lazy_import, result_cache
+
+# scipy.stats and scipy.signal are only loaded when first used:
+stats = lazy_import('scipy.stats')
+signal = lazy_import('scipy.signal')
+
+
+# Results of the spectral analysis, as computed by compute() and drawn by render():
+SpecplusResult = namedtuple('SpecplusResult', ['data', 'freqs', 'power', 'xdata', 'ydata', 'amp', 'beta', 'init',
+                                               'final', 'alpha', 'x', 'y', 'predict_y', 'beta_theoretical'])
+
 
 # ---------------------------------------------------------------------
-# Computes PSD of a time series
-# Optionally receives an interval for the linear regression step
+# One-sided periodogram of the whole series with a Hanning window, scaled to preserve the power in the segment
+# (the same as matplotlib.mlab.psd with NFFT equal to the series length and scale_by_freq=False). Several series can be
+# given along the first axes of 'data', and their periodograms are computed with a single FFT
 # ---------------------------------------------------------------------
-def psd(data, init=None, final=None):
-    n = len(data)
-    time = np.arange(n)
-
-    # If "final" is not given, use length of data
-    if final is None:
-        final = n - 1
-    if init is None:
-        init = 1
+def periodogram(data, fs):
+    data = np.asarray(data, dtype=np.float64)
+    n = data.shape[-1]
+    window = np.hanning(n)
+    n_freqs = n // 2 + 1
+
+    spectrum = np.fft.fft(data * window, axis=-1)[..., :n_freqs]
+    power = np.conj(spectrum) * spectrum
+    # Scale everything except the DC component and, for an even length, the Nyquist component:
+    if n % 2 == 0:
+        power[..., 1:-1] *= 2.0
+    else:
+        power[..., 1:] *= 2.0
+    power /= window.sum() ** 2
 
-    # Define sampling frequency:
-    dt = (time[-1] - time[0] / (n - 1))
-    fs = 1 / dt
+    freqs = np.fft.fftfreq(n, 1 / fs)[:n_freqs]
+    if n % 2 == 0:
+        # get the last value correctly, it is negative otherwise
+        freqs[-1] *= -1
+    return power.real, freqs
 
-    # Compute PSD with MLAB:
-    power, freqs = mlab.psd(data, Fs=fs, NFFT=n, scale_by_freq=False)
 
-    # Select data within selction interval
-    xdata = freqs[init:final]
-    ydata = power[init:final]
+# ---------------------------------------------------------------------
+# Accumulates the PSD of a series fed in chunks, averaging the spectra of overlapping segments of 'nperseg' samples,
+# tapered with a Hanning window ('welch') or with 'n_tapers' discrete prolate spheroidal sequences ('multitaper').
+# Only the samples of an incomplete segment are kept between chunks, so memory does not grow with the series length.
+# Chunks may hold several series along their first axes, whose spectra are accumulated together
+# ---------------------------------------------------------------------
+class SpectrumAccumulator:
+    def __init__(self, nperseg=256, noverlap=None, mode='welch', n_tapers=4, fs=1.0):
+        if noverlap is None:
+            noverlap = nperseg // 2
+        self.nperseg = nperseg
+        self.step = nperseg - noverlap
+        self.fs = fs
+        if mode == 'welch':
+            self.tapers = np.hanning(nperseg)[np.newaxis, :]
+            # Preserve the power in the segment, as periodogram() does:
+            self.scale = 1.0 / self.tapers.sum() ** 2
+        elif mode == 'multitaper':
+            self.tapers = signal.windows.dpss(nperseg, (n_tapers + 1) / 2.0, Kmax=n_tapers)
+            # The tapers have unit energy, so dividing by the segment length gives the same units for white noise:
+            self.scale = 1.0 / nperseg
+        else:
+            raise ValueError("Unknown PSD mode: " + str(mode))
+        self.pending = None
+        self.power_sum = 0.0
+        self.n_segments = 0
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        data = chunk if self.pending is None else np.concatenate((self.pending, chunk), axis=-1)
+        n = data.shape[-1]
+        n_complete = (n - self.nperseg) // self.step + 1 if n >= self.nperseg else 0
+        if n_complete > 0:
+            segments = sliding_window_view(data, self.nperseg, axis=-1)[..., ::self.step, :][..., :n_complete, :]
+            spectra = np.fft.rfft(segments[..., np.newaxis, :] * self.tapers, axis=-1)
+            self.power_sum = self.power_sum + (spectra.real ** 2 + spectra.imag ** 2).mean(axis=-2).sum(axis=-2)
+            self.n_segments += n_complete
+        self.pending = data[..., n_complete * self.step:]
+
+    # Average one-sided spectrum of the segments so far, and the degrees of freedom of each of its estimates:
+    def result(self):
+        if self.n_segments == 0:
+            power = np.zeros(self.nperseg // 2 + 1)
+        else:
+            power = self.scale * self.power_sum / self.n_segments
+        # Scale everything except the DC component and, for an even length, the Nyquist component:
+        dof = np.full(power.shape[-1], 2.0 * self.n_segments * len(self.tapers))
+        last = -1 if self.nperseg % 2 == 0 else None
+        power[..., 1:last] *= 2.0
+        dof[0] /= 2.0
+        if last is not None:
+            dof[-1] /= 2.0
+        freqs = np.fft.rfftfreq(self.nperseg, 1.0 / self.fs)
+        return power, freqs, dof
 
-    # Simulate error
-    yerr = 0.2 * ydata
 
-    # Find logarithms of data:
+# ---------------------------------------------------------------------
+# Fit log10(y) = log10(amp) + index * log10(x) by weighted least squares, in closed form. 'ydata' may hold several
+# series along its first axes, all sampled at 'xdata', which are fitted at once
+# ---------------------------------------------------------------------
+def fit_power_law(xdata, ydata, weights=None):
     logx = np.log10(xdata)
     logy = np.log10(ydata)
+    if weights is None:
+        weights = np.ones(len(logx))
+    sum_w = np.sum(weights)
+    mean_x = np.sum(weights * logx) / sum_w
+    mean_y = np.sum(weights * logy, axis=-1) / sum_w
+    index = np.sum(weights * (logx - mean_x) * (logy - np.expand_dims(mean_y, -1)), axis=-1) \
+        / np.sum(weights * (logx - mean_x) ** 2)
+    amp = 10.0 ** (mean_y - index * mean_x)
+    return amp, index
 
-    logyerr = yerr / ydata
 
-    # Compute line fit:
-    pinit = np.array([1.0, -1.0])
-    out = optimize.leastsq(errfunc, pinit, args=(logx, logy, logyerr), full_output=True)
-    pfinal = out[0]
-    index = pfinal[1]
-    amp = 10.0 ** pfinal[0]
+# ---------------------------------------------------------------------
+# Computes PSD of a time series
+# Optionally receives an interval for the linear regression step. With mode 'welch' or 'multitaper', the spectrum is
+# averaged over segments of nperseg samples: an array (memory-mapped or not) or a pandas Series is read in slices of
+# chunk_size samples, a list or tuple of numbers is a single series, and any other iterable (including a list of
+# arrays) is a stream of consecutive chunks of the same series. A 2-D (series x time) array gives the PSD and the fit
+# of every series, along the first axis of power, ydata, amp and index.
+# ---------------------------------------------------------------------
+def psd(data, init=None, final=None, mode='periodogram', nperseg=256, noverlap=None, n_tapers=4,
+        chunk_size=2 ** 20):
+    if init is None:
+        init = 1
 
-    # Returns obtained values
-    return freqs, power, xdata, ydata, amp, index, init, final
+    if mode == 'periodogram':
+        data = np.asarray(data, dtype=np.float64)
+        n = data.shape[-1]
+        time = np.arange(n)
 
+        # If "final" is not given, use length of data
+        if final is None:
+            final = n - 1
 
-# Define functions to perform data fit:
-def fitfunc(p, x):
-    return p[0] + p[1] * x
+        # Define sampling frequency:
+        dt = (time[-1] - time[0] / (n - 1))
+        fs = 1 / dt
 
+        # Compute PSD:
+        power, freqs = periodogram(data, fs)
+        weights = None
+    else:
+        # Arrays (memory-mapped or not) are read in slices as they are, Series and lists of numbers are converted to
+        # arrays first, and anything else is read as a stream of chunks:
+        if hasattr(data, 'to_numpy'):
+            data = data.to_numpy(dtype=np.float64)
+        elif isinstance(data, (list, tuple)) and (len(data) == 0 or np.ndim(data[0]) == 0):
+            data = np.asarray(data, dtype=np.float64)
+        if isinstance(data, np.ndarray):
+            nperseg = min(nperseg, data.shape[-1])
+        accumulator = SpectrumAccumulator(nperseg=nperseg, noverlap=noverlap, mode=mode, n_tapers=n_tapers)
+        if isinstance(data, np.ndarray):
+            for first in range(0, data.shape[-1], chunk_size):
+                accumulator.update(data[..., first:first + chunk_size])
+        else:
+            for chunk in data:
+                accumulator.update(chunk)
+        power, freqs, dof = accumulator.result()
+        if final is None:
+            final = len(freqs)
+        # The variance of the log of an averaged spectrum is inversely proportional to its degrees of freedom:
+        weights = dof[init:final]
 
-def errfunc(p, x, y, err):
-    return (y - fitfunc(p, x)) / err
+    # Select data within selction interval
+    xdata = freqs[init:final]
+    ydata = power[..., init:final]
+
+    # Compute line fit:
+    amp, index = fit_power_law(xdata, ydata, weights)
+
+    # Returns obtained values
+    return freqs, power, xdata, ydata, amp, index, init, final
 
 
 # Define a function to compute a Power Law:
@@ -77,59 +197,130 @@ def powerlaw(x, amp, index):
     return amp * (x ** index)
 
 
+# ---------------------------------------------------------------------
+# Scales of the DFA: from 4 up to a quarter of the series length, growing in geometric series according to 'Boxratio'
+# ---------------------------------------------------------------------
+def dfa_scales(tam):
+    sf = int(np.ceil(tam / 4))
+    boxratio = np.power(2.0, 1.0 / 8.0)
+    scales = []
+    s = 4
+    while s <= sf:
+        scales.append(s)
+        s = int(np.ceil(s * boxratio))
+    return np.array(scales, dtype=int)
+
+
+# ---------------------------------------------------------------------
+# Orthonormal basis of the polynomials of degree up to 'order' sampled on a window of size s. Projecting a window on it
+# gives the least-squares polynomial fit in closed form, and the basis only depends on the scale, so it is kept
+# ---------------------------------------------------------------------
+@functools.lru_cache(maxsize=512)
+def detrending_basis(s, order):
+    x = np.arange(1, s + 1, dtype=np.float64)
+    # Center and scale the abscissa to keep the Vandermonde matrix well conditioned:
+    x = (x - x.mean()) / max(s - 1, 1)
+    basis, _ = np.linalg.qr(np.vander(x, order + 1, increasing=True))
+    basis.setflags(write=False)
+    return basis
+
+
+# Matrix that maps a window of size s to its residual. Applied directly for small windows, where one product with it is
+# cheaper than projecting on the basis and subtracting:
+@functools.lru_cache(maxsize=64)
+def residual_projector(s, order):
+    basis = detrending_basis(s, order)
+    projector = np.eye(s) - basis @ basis.T
+    projector.setflags(write=False)
+    return projector
+
+
+# ---------------------------------------------------------------------
+# Fluctuation function of the profile Y(k) (along its last axis) at each scale. Windows of size s start every
+# s * (1 - overlap) samples, and with both_ends the segmentation is repeated from the end of the series, so its
+# remainder is not discarded. Windows are strided views of the profile, detrended a chunk of at most 'chunk_size'
+# samples at a time, so the cost of each scale is linear on the series length and memory stays bounded
+# ---------------------------------------------------------------------
+def dfa_fluctuation(profile, scales, order=1, overlap=0.0, both_ends=False, chunk_size=2 ** 22):
+    profile = np.asarray(profile, dtype=np.float64)
+    n = profile.shape[-1]
+    batch = profile.shape[:-1]
+    n_series = int(np.prod(batch))
+    fluctuation = np.zeros(batch + (len(scales),))
+
+    for idx, s in enumerate(scales):
+        s = int(s)
+        step = max(1, int(round(s * (1.0 - overlap))))
+        basis = detrending_basis(s, order)
+        views = [sliding_window_view(profile, s, axis=-1)[..., ::step, :]]
+        if both_ends:
+            views.append(sliding_window_view(profile[..., (n - s) % step:], s, axis=-1)[..., ::step, :])
+
+        # 3. Compute the variance of the residuals of all segments at once, accumulating sums over the chunks:
+        total = np.zeros(batch)
+        total_square = np.zeros(batch)
+        count = 0
+        rows = max(1, chunk_size // (s * n_series))
+        buffer = np.empty(batch + (min(rows, n // step + 1), s))
+        for view in views:
+            for first in range(0, view.shape[-2], rows):
+                windows = view[..., first:first + rows, :]
+                residual = buffer[..., :windows.shape[-2], :]
+                if s <= 16:
+                    np.matmul(windows, residual_projector(s, order), out=residual)
+                else:
+                    np.matmul(windows @ basis, basis.T, out=residual)
+                    np.subtract(windows, residual, out=residual)
+                total += residual.sum(axis=(-2, -1))
+                total_square += np.einsum('...ij,...ij->...', residual, residual)
+                count += windows.shape[-2] * s
+
+        # 4. The fluctuation function is the standard deviation of the residuals:
+        mean = total / count
+        fluctuation[..., idx] = np.sqrt(total_square / count - mean ** 2)
+
+    return fluctuation
+
+
 # ---------------------------------------------------------------------
 # Compute 1D DFA for the time series
 # ---------------------------------------------------------------------
-def dfa1d(time_series, grau):
+def dfa1d(time_series, grau, overlap=0.0, both_ends=False):
     # Compute 1D DFA (adapted from Physionet), where the sclae frows according to 'Boxratio'. Returns the array
     # 'vetoutput', where the first column is the logarithm of S scale and the second column is the logarithm of the
-    # fluctuation function
+    # fluctuation function. A 2-D (series x time) 'time_series' is analysed on a shared scale grid, giving the results
+    # of every series along the first axis
 
     # 1. The time series {Xk} with k = 1, ..., N is integrated into the profile function Y(k)
-    x = np.mean(time_series)
+    time_series = np.asarray(time_series, dtype=np.float64)
+    x = np.mean(time_series, axis=-1, keepdims=True)
     time_series = time_series - x
-    yk = np.cumsum(time_series)
-    tam = len(time_series)
-
-    # 2. The (or profile) Y(k) is divided into N non-overlapping intervals of size S
-    sf = np.ceil(tam / 4).astype(np.int)
-    boxratio = np.power(2.0, 1.0 / 8.0)
-    vetoutput = np.zeros(shape=(1, 2))
-    s = 4
+    yk = np.cumsum(time_series, axis=-1)
+    tam = time_series.shape[-1]
 
-    while s <= sf:
-        serie = yk
-        if np.mod(tam, s) != 0:
-            aux = s * int(np.trunc(tam / s))
-            serie = yk[0:aux]
-        t = np.arange(s, len(serie), s)
-        v = np.array(np.array_split(serie, t))
-        x = np.arange(1, s + 1)
-
-        # 3. Compute variance for each segment v = 1,…, n_s:
-        p = np.polynomial.polynomial.polyfit(x, v.T, grau)
-        yfit = np.polynomial.polynomial.polyval(x, p)
-        vetvar = np.var(v - yfit)
-
-        # 4. Compute the the fluctuation function of the DFA as the average of the variances in each interval
-        fs = np.sqrt(np.mean(vetvar))
-        vetoutput = np.vstack((vetoutput, [s, fs]))
-
-        # S scale grows in geometric series
-        s = np.ceil(s * boxratio).astype(np.int)
+    # 2. The (or profile) Y(k) is divided into N non-overlapping intervals of size S (optionally overlapping, or
+    # segmented from both ends), and steps 3. and 4. are done by dfa_fluctuation():
+    scales = dfa_scales(tam)
+    fs = dfa_fluctuation(yk, scales, grau, overlap=overlap, both_ends=both_ends)
 
     # Array with S scale log values and fluctuation function log values
-    vetoutput = np.log10(vetoutput[1::1, :])
+    vetoutput = np.log10(np.stack(np.broadcast_arrays(scales, fs), axis=-1))
 
     # Split the columns of 'vetoutput'
-    x = vetoutput[:, 0]
-    y = vetoutput[:, 1]
+    x = np.log10(scales)
+    y = vetoutput[..., 1]
 
     # Linear Regression
-    slope, intercept, _, _, _ = stats.linregress(x, y)
+    if y.ndim == 1:
+        slope, intercept, _, _, _ = stats.linregress(x, y)
+    else:
+        # The same least squares line, for all series at once:
+        x_centred = x - np.mean(x)
+        slope = (y - np.mean(y, axis=-1, keepdims=True)) @ x_centred / np.sum(x_centred ** 2)
+        intercept = np.mean(y, axis=-1) - slope * np.mean(x)
 
     # Compute line
-    predict_y = intercept + slope * x
+    predict_y = np.expand_dims(intercept, -1) + np.expand_dims(slope, -1) * x
 
     # Compute error
     pred_error = y - predict_y
@@ -139,12 +330,37 @@ def dfa1d(time_series, grau):
 
 
 # ---------------------------------------------------------------------
-# Main section
+# Compute PSD and DFA, without plotting
 # ---------------------------------------------------------------------
-def main(data):
+def compute(data):
     # Disble numpy errors and warnings
     np.seterr(divide='ignore', invalid='ignore', over='ignore')
 
+    # Compute PSD
+    freqs, power, xdata, ydata, amp, index, init, fim = psd(data)
+
+    # Beta value is equivalent to the index:
+    beta = index
+
+    # Compute 1D DFA
+    alfa, vetoutput, x, y, reta, error = dfa1d(data, 1)
+    # From Neelakshi et. al. (2019) "Spectral fluctuation analysis of ionospheric inhomogeneities over Brazilian
+    # territory Part II: EF valley region plasma instabilities"
+    # "S. Heneghan and McDarby (2000) established an equivalence relation between the PSD exponent, b, and the DFA
+    # exponent, a, given by beta =  2 * alpha - 1. Kiyono (2015) showed that this relationship is valid for
+    # the higher order DFA subject to the constraint  0<a<m+1, where m is the order of detrending polynomial in the DFA"
+    beta_theoretical = 2 * alfa - 1
+
+    return SpecplusResult(data, freqs, power, xdata, ydata, amp, beta, init, fim, alfa, x, y, reta, beta_theoretical)
+
+
+# ---------------------------------------------------------------------
+# Plot the results of compute()
+# ---------------------------------------------------------------------
+def render(result):
+    # Plotting is optional, so matplotlib is only imported here:
+    import matplotlib.pyplot as plt
+
     # -----------------------------------------------------------------
     # General plot parameters:
     # -----------------------------------------------------------------
@@ -175,7 +391,7 @@ def main(data):
 
     # Plot original data series:
     fig_handle = fig.add_subplot(2, 1, 1)
-    fig_handle.plot(data, '-', color=cor_serie_original)
+    fig_handle.plot(result.data, '-', color=cor_serie_original)
     fig_handle.set_title(text_title_original, fontsize=size_font_title)
     fig_handle.set_xlabel(text_axis_x, fontsize=size_font_axis_x)
     fig_handle.set_ylabel(text_axis_y, fontsize=size_font_axis_y)
@@ -183,15 +399,9 @@ def main(data):
     fig_handle.grid()
 
     # -----------------------------------------------------------------
-    # Compute and plot PSD
+    # Plot PSD
     # -----------------------------------------------------------------
 
-    # Compute PSD
-    freqs, power, xdata, ydata, amp, index, init, fim = psd(data)
-
-    # Beta value is equivalent to the index:
-    beta = index
-
     # Define plot colors:
     cor_psd1 = 'k'
     cor_psd2 = 'navy'
@@ -201,40 +411,29 @@ def main(data):
     texto_psdy = 'Power'
     texto_titulo_psd = r'Power Spectrum Density $\beta$ = '
 
-    # -----------------------------------------------------------------
-    # Compute and plot DFA
-    # -----------------------------------------------------------------
-
-    # Compute 1D DFA
-    alfa, vetoutput, x, y, reta, error = dfa1d(data, 1)
-    # From Neelakshi et. al. (2019) "Spectral fluctuation analysis of ionospheric inhomogeneities over Brazilian
-    # territory Part II: EF valley region plasma instabilities"
-    # "S. Heneghan and McDarby (2000) established an equivalence relation between the PSD exponent, b, and the DFA
-    # exponent, a, given by beta =  2 * alpha - 1. Kiyono (2015) showed that this relationship is valid for
-    # the higher order DFA subject to the constraint  0<a<m+1, where m is the order of detrending polynomial in the DFA"
-    beta_theoretical = 2 * alfa - 1
-
-    # Plot PSD
-
     fig_handle = fig.add_subplot(2, 2, 3)
 
-    fig_handle.plot(freqs, power, '-', color=cor_psd1, alpha=0.7)
-    fig_handle.plot(xdata, ydata, color=cor_psd2, alpha=0.8)
-    fig_handle.axvline(freqs[init], color=cor_psd2, linestyle='--')
-    fig_handle.axvline(freqs[-1], color=cor_psd2, linestyle='--')
-    fig_handle.plot(xdata, powerlaw(xdata, amp, index), 'r-', linewidth=1.5, label='$%.4f$' % beta)
+    fig_handle.plot(result.freqs, result.power, '-', color=cor_psd1, alpha=0.7)
+    fig_handle.plot(result.xdata, result.ydata, color=cor_psd2, alpha=0.8)
+    fig_handle.axvline(result.freqs[result.init], color=cor_psd2, linestyle='--')
+    fig_handle.axvline(result.freqs[-1], color=cor_psd2, linestyle='--')
+    fig_handle.plot(result.xdata, powerlaw(result.xdata, result.amp, result.beta), 'r-', linewidth=1.5,
+                    label='$%.4f$' % result.beta)
     fig_handle.set_xlabel(texto_psdx, fontsize=size_font_axis_x)
     fig_handle.set_ylabel(texto_psdy, fontsize=size_font_axis_y)
-    fig_handle.set_title(texto_titulo_psd + r'%.4f (Theoretical $\beta$ = 2$\alpha$ -1 = %.4f)' % (beta,
-                                                                                                   beta_theoretical),
-                         loc='center', fontsize=size_font_title)
+    fig_handle.set_title(texto_titulo_psd + r'%.4f (Theoretical $\beta$ = 2$\alpha$ -1 = %.4f)' % (
+        result.beta, result.beta_theoretical), loc='center', fontsize=size_font_title)
     fig_handle.set_yscale('log')
     fig_handle.set_xscale('log')
     fig_handle.grid()
 
+    # -----------------------------------------------------------------
+    # Plot DFA
+    # -----------------------------------------------------------------
+
     # Checks if DFA has valid value. If so, proceed with plot:
 
-    if not math.isnan(alfa):
+    if not math.isnan(result.alpha):
 
         # Define plot colors:
         cor_dfa = 'darkmagenta'
@@ -246,9 +445,10 @@ def main(data):
 
         # Plot DFA
         fig_dfa = fig.add_subplot(2, 2, 4)
-        fig_dfa.plot(x, y, 's', color=cor_dfa, markersize=4, markeredgecolor='r', markerfacecolor='None', alpha=0.8)
-        fig_dfa.plot(x, reta, '-', color=cor_dfa, linewidth=1.5)
-        fig_dfa.set_title(texto_titulo_dfa + '%.4f' % alfa, loc='center', fontsize=size_font_title)
+        fig_dfa.plot(result.x, result.y, 's', color=cor_dfa, markersize=4, markeredgecolor='r',
+                     markerfacecolor='None', alpha=0.8)
+        fig_dfa.plot(result.x, result.predict_y, '-', color=cor_dfa, linewidth=1.5)
+        fig_dfa.set_title(texto_titulo_dfa + '%.4f' % result.alpha, loc='center', fontsize=size_font_title)
         fig_dfa.set_xlabel(texto_dfax, fontsize=size_font_axis_x)
         fig_dfa.set_ylabel(texto_dfay, fontsize=size_font_axis_y)
         fig_dfa.grid()
@@ -265,8 +465,17 @@ def main(data):
     # img_filename = 'ANALYSIS_PSD_DFA_2.png'
     # plt.savefig(img_filename, dpi=300, bbox_inches='tight', pad_inches=0.1)
     plt.draw()
+    return fig
+
 
-    return alfa, beta_theoretical
+# ---------------------------------------------------------------------
+# Main section
+# ---------------------------------------------------------------------
+@result_cache.cached()
+def main(data):
+    result = compute(data)
+    render(result)
+    return result.alpha, result.beta_theoretical
 
 
 # Sample execution:
@@ -275,4 +484,5 @@ if __name__ == "__main__":
     series_x, series_y = np.random.multivariate_normal(mean, cov, size=800).T
     test_data = series_x.tolist()
     alpha, beta_t = main(test_data)
+    import matplotlib.pyplot as plt
     plt.show()
@@ -0,0 +1,148 @@
+########################################################################################################################
+# Surrogate series and ensemble (bootstrap) uncertainty of the spectral and multifractal indices computed by specplus
+# and mfdfa_ss. Surrogates are generated and analysed in chunks spread over a process pool, and the percentiles of the
+# indices over the ensemble give their intervals.
+#
+# Written by Rian Koja to publish in a GitHub repository with specified license.
+########################################################################################################################
+
+# Standard imports:
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Local imports:
+from tools import mfdfa_ss, specplus
+import tools.mfdfa_ss_m2 as mfdfa2
+
+
+# Indices estimated for the series and each surrogate:
+index_names = ['alpha', 'beta', 'beta_theoretical', 'delta_alpha', 'alpha_zero', 'a_alpha']
+
+# Data used by every chunk of surrogates in a process, set once per worker by init_worker:
+shared = {}
+
+
+def init_worker(series, method, options):
+    shared.update(series=series, method=method, options=options)
+
+
+# Surrogates with the same power spectrum as 'series', with the phases of its Fourier components drawn at random:
+def phase_randomised(series, n_surrogates, rng):
+    series = np.asarray(series, dtype=np.float64)
+    n = len(series)
+    spectrum = np.fft.rfft(series)
+    phases = rng.uniform(0.0, 2.0 * np.pi, (n_surrogates, len(spectrum)))
+    # The mean, and for an even length the Nyquist component, must stay real:
+    phases[:, 0] = 0.0
+    if n % 2 == 0:
+        phases[:, -1] = 0.0
+    return np.fft.irfft(np.abs(spectrum) * np.exp(1j * phases), n, axis=-1)
+
+
+# Iterative amplitude adjusted Fourier transform surrogates, which keep both the values of 'series' and (approximately)
+# its power spectrum. All surrogates are iterated together, until none of them changes its ranks or 'max_iter' is hit:
+def iaaft(series, n_surrogates, rng, max_iter=200):
+    series = np.asarray(series, dtype=np.float64)
+    n = len(series)
+    sorted_values = np.sort(series)
+    amplitudes = np.abs(np.fft.rfft(series))
+
+    surrogates = rng.permuted(np.tile(series, (n_surrogates, 1)), axis=1)
+    ranks = np.argsort(np.argsort(surrogates, axis=1), axis=1)
+    for _ in range(max_iter):
+        # Impose the power spectrum, keeping the phases ...
+        spectrum = np.fft.rfft(surrogates, axis=1)
+        surrogates = np.fft.irfft(amplitudes * np.exp(1j * np.angle(spectrum)), n, axis=1)
+        # ... and then the values, keeping the ranks:
+        new_ranks = np.argsort(np.argsort(surrogates, axis=1), axis=1)
+        surrogates = sorted_values[new_ranks]
+        if np.array_equal(new_ranks, ranks):
+            break
+        ranks = new_ranks
+    return surrogates
+
+
+# Moving block bootstrap: surrogates made of blocks of 'block_length' consecutive values of 'series' (by default, the
+# cube root of its length) starting at random positions, which keep its short range correlations:
+def block_bootstrap(series, n_surrogates, rng, block_length=None):
+    series = np.asarray(series, dtype=np.float64)
+    n = len(series)
+    if block_length is None:
+        block_length = max(1, int(round(n ** (1.0 / 3.0))))
+    n_blocks = -(-n // block_length)
+    starts = rng.integers(0, n - block_length + 1, (n_surrogates, n_blocks))
+    indices = (starts[:, :, np.newaxis] + np.arange(block_length)).reshape(n_surrogates, -1)[:, :n]
+    return series[indices]
+
+
+surrogate_methods = {'phase': phase_randomised, 'iaaft': iaaft, 'block': block_bootstrap}
+
+
+# Indices of each row of the (M, N) array 'batch'. The DFA and the PSD of all rows are computed at once, the MF-DFA one
+# row at a time:
+def batch_indices(batch, multifractal=True):
+    batch = np.atleast_2d(np.asarray(batch, dtype=np.float64))
+    indices = {name: np.full(len(batch), np.nan) for name in index_names}
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        indices['alpha'] = specplus.dfa1d(batch, 1)[0]
+        indices['beta_theoretical'] = 2 * indices['alpha'] - 1
+        indices['beta'] = specplus.psd(batch)[5]
+        if multifractal:
+            for row, series in enumerate(batch):
+                stats = mfdfa_ss.add_characteristics(mfdfa2.get_mss_by_upscaling(series)[3])
+                for name in ['delta_alpha', 'alpha_zero', 'a_alpha']:
+                    indices[name][row] = stats[name]
+    return indices
+
+
+# Generate and analyse 'n_surrogates' surrogates of the shared series with a random generator seeded by 'seed':
+def surrogate_chunk(seed, n_surrogates):
+    options = dict(shared['options'])
+    multifractal = options.pop('multifractal', True)
+    rng = np.random.default_rng(seed)
+    batch = surrogate_methods[shared['method']](shared['series'], n_surrogates, rng, **options)
+    return batch_indices(batch, multifractal=multifractal)
+
+
+# Percentile intervals of the indices of 'series' over an ensemble of 'n_surrogates' surrogates generated with 'method'
+# ('phase', 'iaaft' or 'block', whose keyword arguments go in 'options'). Chunks of 'chunk_size' surrogates are spread
+# over a pool of 'processes' processes (None uses every core, 0 runs in this process). Returns a dictionary with the
+# estimates for the series, the percentiles of every index over the ensemble, the ensemble itself and the run time:
+def ensemble_intervals(series, n_surrogates=1000, method='iaaft', percentiles=(2.5, 50.0, 97.5), processes=None,
+                       chunk_size=50, seed=0, multifractal=True, **options):
+    time_ini = time.perf_counter()
+    if method not in surrogate_methods:
+        raise ValueError("Unknown surrogate method: " + str(method))
+    series = np.asarray(series, dtype=np.float64)
+    options['multifractal'] = multifractal
+    init_args = (series, method, options)
+
+    # Each chunk gets an independent random stream, so the ensemble does not depend on how chunks are scheduled:
+    sizes = [min(chunk_size, n_surrogates - first) for first in range(0, n_surrogates, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    if processes == 0:
+        init_worker(*init_args)
+        chunks = list(map(surrogate_chunk, seeds, sizes))
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_worker, initargs=init_args) as pool:
+            chunks = list(pool.map(surrogate_chunk, seeds, sizes))
+
+    ensemble = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in index_names}
+    estimate = {name: value[0] for name, value in batch_indices(series, multifractal=multifractal).items()}
+    intervals = {name: dict(zip(percentiles, np.nanpercentile(ensemble[name], percentiles)))
+                 if np.any(np.isfinite(ensemble[name])) else {} for name in index_names}
+    return {'estimate': estimate, 'intervals': intervals, 'ensemble': ensemble, 'method': method,
+            'n_surrogates': n_surrogates, 'wall_time': time.perf_counter() - time_ini}
+
+
+# Sample execution:
+if __name__ == "__main__":
+    sample_data = np.cumsum(np.random.default_rng(0).normal(size=512))
+    for sample_method in surrogate_methods:
+        sample_result = ensemble_intervals(sample_data, n_surrogates=200, method=sample_method)
+        print("{} {} surrogates analysed in {:.2f} s".format(
+            sample_result['n_surrogates'], sample_method, sample_result['wall_time']))
+        for sample_name in index_names:
+            print(sample_name, sample_result['estimate'][sample_name], sample_result['intervals'][sample_name])